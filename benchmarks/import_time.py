@@ -0,0 +1,59 @@
+################################
+# startup benchmark: time of `python -c 'import popsims'` and number of imported modules
+# usage: python benchmarks/import_time.py [--repeat N] [--statement 'from popsims import Disk']
+##############################
+"""Time `import popsims` in a fresh interpreter and count the modules it imports"""
+import argparse
+import json
+import subprocess
+import sys
+import numpy as np
+
+HEAVY_MODULES=['numba', 'scipy', 'pandas', 'astropy.coordinates', 'seaborn', 'matplotlib', 'tqdm',
+               'popsims.evol_models', 'popsims.simulator']
+
+_PROBE="""
+import sys, time, json
+before=set(sys.modules)
+t0=time.perf_counter()
+{statement}
+t1=time.perf_counter()
+new=set(sys.modules)-before
+print(json.dumps({{'time': t1-t0, 'nmodules': len(new), 'heavy': [m for m in {heavy} if m in sys.modules]}}))
+"""
+
+def measure(statement='import popsims', repeat=5):
+    """
+    Run the import statement in fresh interpreters and collect wall time and imported modules
+
+    Args:
+    ----
+        statement: python statement to time (str)
+        repeat: number of fresh interpreters (int)
+    Returns:
+    -------
+        dictionary with median time (s), number of imported modules and heavy modules loaded
+    """
+    runs=[]
+    for _ in range(repeat):
+        out=subprocess.run([sys.executable, '-c', _PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+                           check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return {'statement': statement,
+            'median_time': float(np.median([r['time'] for r in runs])),
+            'nmodules': runs[-1]['nmodules'],
+            'heavy': runs[-1]['heavy']}
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--statement', action='append')
+    args=parser.parse_args()
+    statements=args.statement or ['import popsims',
+                                  'from popsims import sample_from_powerlaw',
+                                  'from popsims import Disk; Disk().volume(0., 0., 1., 100.)',
+                                  'from popsims import Population']
+    for statement in statements:
+        res=measure(statement, repeat=args.repeat)
+        print('{:<60} {:8.3f} s {:6d} modules  heavy: {}'.format(res['statement'], res['median_time'],
+                                                               res['nmodules'], ', '.join(res['heavy'])))
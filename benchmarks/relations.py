@@ -0,0 +1,53 @@
+################################
+# array benchmark of the teff/spt relations for 1e3 to 1e7 inputs
+# usage: python benchmarks/relations.py [--repeat N] [--max-size 1e7]
+##############################
+"""Time the array teff/spt relations for 1e3 to 1e7 inputs"""
+import argparse
+import time
+import numpy as np
+
+from popsims.relations import teff_to_spt_pecaut, spt_to_teff_pecaut, teff_to_spt_kirkpatrick, spt_to_teff_kirkpatrick
+
+#relation name, function, range of the input values
+RELATIONS=[('teff_to_spt_pecaut', teff_to_spt_pecaut, (2000., 5000.)),
+           ('spt_to_teff_pecaut', spt_to_teff_pecaut, (0., 40.)),
+           ('teff_to_spt_kirkpatrick', teff_to_spt_kirkpatrick, (300., 2200.)),
+           ('spt_to_teff_kirkpatrick', spt_to_teff_kirkpatrick, (20., 40.))]
+
+def measure(func, x, repeat=3):
+    """
+    Best wall time of func(x) over repeat calls, after one warm-up call
+
+    Args:
+    ----
+        func: relation (callable taking an array and an rng keyword)
+        x: input values (array)
+        repeat: number of timed calls (int)
+    Returns:
+    -------
+        time in seconds (float)
+    """
+    rng=np.random.default_rng(0)
+    func(x[:10], rng=rng)
+    times=[]
+    for _ in range(repeat):
+        t0=time.perf_counter()
+        func(x, rng=rng)
+        times.append(time.perf_counter()-t0)
+    return min(times)
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-size', type=float, default=1e7)
+    parser.add_argument('--relation', action='append')
+    args=parser.parse_args()
+    sizes=[int(10**p) for p in range(3, int(np.log10(args.max_size))+1)]
+    rng=np.random.default_rng(42)
+    for name, func, (lo, hi) in RELATIONS:
+        if args.relation and name not in args.relation:
+            continue
+        for size in sizes:
+            t=measure(func, rng.uniform(lo, hi, size), repeat=args.repeat)
+            print('{:<26} {:>10d} {:10.4f} s {:10.1f} ns/value'.format(name, size, t, 1e9*t/size))
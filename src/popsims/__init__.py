@@ -1,9 +1,60 @@
 
 from __future__ import print_function, division
+import importlib
 
 __version__ = "0.1.0"
 __author__ = 'Christian Aganze'
 
-from .core import *
-from .core_tools import *
-from .simulator import *
+#submodules are imported on first attribute access, so `import popsims` does not pull in
+#scipy, astropy, pandas, seaborn or the evolutionary model grids until they are needed.
+#the names of core, core_tools and simulator are the __all__ of those modules (they used to be star-imported),
+#any other name raises AttributeError without importing anything, so hasattr probes stay cheap
+_LAZY_ATTRIBUTES={
+    #core_tools
+    'get_rng': 'core_tools', 'get_seed_sequence': 'core_tools', 'spawn_rngs': 'core_tools', 'sample_from_powerlaw': 'core_tools', 'sample_from_broken_powerlaw': 'core_tools', 'random_draw': 'core_tools', 'make_spt_number': 'core_tools',
+    'random_normal_angles': 'core_tools', 'random_angles': 'core_tools', 'get_distance': 'core_tools',
+    'trapzl': 'core_tools', 'dropnans': 'core_tools', 'group_by': 'core_tools', 'k_clip_fit': 'core_tools',
+    'apply_polynomial_relation': 'core_tools', 'inverse_polynomial_relation': 'core_tools',
+    'compile_poly1d_relations': 'core_tools', 'evaluate_poly1d_relations': 'core_tools',
+    'compile_polynomial_relation': 'core_tools', 'polynomial_mean_and_scatter': 'core_tools', 'inverse_polynomial_table': 'core_tools',
+    'fast_2d_interpolation': 'core_tools', 'simplex_barycentric_weights': 'core_tools', 'content_key': 'core_tools',
+    'apply_barycentric_weights': 'core_tools', 'bilinear_interpolation': 'core_tools',
+    'barycentric_weights': 'core_tools', 'interpolate_2d': 'core_tools', 'EPSILON': 'core_tools',
+    #core
+    'get_system_type': 'core', 'evolutionary_model_interpolator': 'core', 'EvolutionaryModel': 'core',
+    'EVOL_MODEL_CACHE': 'core', 'ModelCache': 'core_tools', 'EvolutionaryGrid': 'core', 'PopulationTable': 'core',
+    'EVOL_MODELS': 'evol_models',
+    #relations
+    'scale_to_local_lf': 'relations', 'scale_histograms_to_local_lf': 'relations', 'local_lf_histograms': 'relations',
+    'teff_to_spt_kirkpatrick': 'relations', 'spt_to_teff_kirkpatrick': 'relations',
+    'teff_to_spt_pecaut': 'relations', 'spt_to_teff_pecaut': 'relations', 'teff_to_spt_subdwarf': 'relations',
+    'TabulatedRelation': 'relations', 'PECAUT_SPT_TO_TEFF': 'relations', 'PECAUT_TEFF_TO_SPT': 'relations',
+    #galaxy
+    'GalacticComponent': 'galaxy', 'Disk': 'galaxy', 'Halo': 'galaxy', 'Uniform': 'galaxy', 'M31Halo': 'galaxy',
+    'exponential_density': 'galaxy', 'spheroid_density': 'galaxy', 'transform_tocylindrical': 'galaxy',
+    'cylindrical_to_cartesian': 'galaxy', 'get_velocities': 'galaxy',
+    #distributions
+    'PowerLawIMF': 'distributions', 'BrokenPowerLawIMF': 'distributions', 'LogNormalIMF': 'distributions',
+    'UniformAges': 'distributions', 'ExponentialSFH': 'distributions', 'TabulatedDistribution': 'distributions',
+    #simulator
+    'Population': 'simulator', 'make_systems': 'simulator', 'pop_mags': 'simulator',
+    'compute_vols_and_numbers': 'simulator',
+    #constants
+    'Rsun': 'constants', 'Zsun': 'constants', 'galcen_frame': 'constants',
+}
+
+_SUBMODULES=('abs_mag_relations', 'binaries', 'constants', 'core', 'core_tools', 'distributions', 'evol_models', 'galaxy',
+             'plot_style', 'plot_tools', 'relations', 'simulator')
+
+__all__=list(_LAZY_ATTRIBUTES.keys())
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module=importlib.import_module('.'+_LAZY_ATTRIBUTES[name], __name__)
+        return getattr(module, name)
+    if name in _SUBMODULES:
+        return importlib.import_module('.'+name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__) | set(_SUBMODULES))
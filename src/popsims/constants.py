@@ -1,16 +1,22 @@
 ###
 # This module contains a list of constants
 ##
-
-##coordinate system
-import astropy.coordinates as astro_coord
 import numpy as np
-import astropy.units as u
 
 Rsun=8300.
 Zsun=27.
-#default coordinate frame
-#sharma coordinate frame https://www.galah-survey.org/dr3/the_catalogues/#ages-masses-distances-and-other-parameters-estimated-by-bstep
-v_sun = astro_coord.CartesianDifferential([11.1, 248., 7.25]*u.km/u.s) 
-galcen_frame =astro_coord.Galactocentric(galcen_distance=8.2*u.kpc,
-                                    galcen_v_sun=v_sun)
\ No newline at end of file
+
+def __getattr__(name):
+    #astropy.coordinates is slow to import, the default frame is built on first access
+    if name in ('v_sun', 'galcen_frame'):
+        ##coordinate system
+        import astropy.coordinates as astro_coord
+        import astropy.units as u
+        #default coordinate frame
+        #sharma coordinate frame https://www.galah-survey.org/dr3/the_catalogues/#ages-masses-distances-and-other-parameters-estimated-by-bstep
+        v_sun = astro_coord.CartesianDifferential([11.1, 248., 7.25]*u.km/u.s) 
+        galcen_frame =astro_coord.Galactocentric(galcen_distance=8.2*u.kpc,
+                                            galcen_v_sun=v_sun)
+        globals().update({'v_sun': v_sun, 'galcen_frame': galcen_frame})
+        return globals()[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
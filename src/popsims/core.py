@@ -1,6 +1,4 @@
 
-from scipy.interpolate import griddata
-import astropy.units as u
 import numba
 import pandas as pd
 import numpy as np
@@ -9,9 +7,14 @@ import sys
 
 from .relations import  scale_to_local_lf, teff_to_spt_kirkpatrick, \
 spt_to_teff_kirkpatrick, teff_to_spt_pecaut, spt_to_teff_pecaut
-from .core_tools import sample_from_powerlaw, fast_2d_interpolation
+from .core_tools import sample_from_powerlaw, fast_2d_interpolation, simplex_barycentric_weights, \
+apply_barycentric_weights, bilinear_interpolation, ModelCache
 from .evol_models import EVOL_MODELS
 
+#names re-exported by the popsims package
+__all__=['get_system_type', 'PopulationTable', 'EVOL_MODEL_CACHE', 'evolutionary_model_interpolator',
+         'EvolutionaryGrid', 'EvolutionaryModel']
+
 #DATA_FOLDER=os.environ['POPSIMS_DATA_FOLDER']
 
 #CODE_FOLDER=os.path.abspath(os.path.join(os.path.dirname(__file__),os.pardir))
@@ -24,98 +27,545 @@ def _read_bintemplates():
     tbl=pd.DataFrame(BINARIES)
     return [tbl.prim.values, tbl.sec.values, tbl.sys.values]
 
+#dense (primary, secondary) -> system type table, built on first use
+_BINARY_TEMPLATE_TABLE=None
 
-def get_system_type(pr, sc):
+def _binary_template_table():
     """
-    Determine the type of a system based on its primary and secondary attributes.
+    Templates on a dense integer grid of primary and secondary spectral types.
+    The templates only cover secondaries later than primaries, the other half of the
+    table is filled by symmetry so that bilinear lookups next to the diagonal stay finite
 
-    This function takes the primary and secondary attributes of a system and
-    uses interpolation to determine the type of the system based on these
-    attributes. The system type is returned as a floating point value.
+    Returns:
+    -------
+        first spectral type of the grid (float), table (array, (n, n, 1))
+    """
+    global _BINARY_TEMPLATE_TABLE
+    if _BINARY_TEMPLATE_TABLE is None:
+        prim, sec, sys= _read_bintemplates()
+        spt0= float(np.min([prim.min(), sec.min()]))
+        n= int(np.max([prim.max(), sec.max()])-spt0)+1
+        table= np.full((n, n), np.nan)
+        ip= np.round(prim-spt0).astype(int)
+        isc= np.round(sec-spt0).astype(int)
+        table[isc, ip]= sys
+        table[ip, isc]= sys
+        _BINARY_TEMPLATE_TABLE= (spt0, np.ascontiguousarray(table[:,:,None]))
+    return _BINARY_TEMPLATE_TABLE
 
-    Args:
-        pr: The primary attribute of the system, as a floating point value.
-        sc: The secondary attribute of the system, as a floating point value.
+def get_system_type(pr, sc, spt_range=(15, 39)):
+    """
+    Combined spectral type of a binary from the spectral types of its components,
+    by bilinear lookup in the binary templates
 
+    Args:
+    ----
+        pr: spectral types of the primaries (float or array)
+        sc: spectral types of the secondaries (float or array), nans are treated as single stars
+        spt_range: optional, primaries outside this range have no templates and keep their own type
     Returns:
-        The type of the system, as a floating point value.
+    -------
+        system spectral types (array), nans for pairs outside the templates
 
-    #generated by chatGPT
+    Examples:
+    --------
+        > get_system_type(np.array([20., 25.]), np.array([30., 35.]))
     """
-    # Function implementation goes here
-
-    interpolators= _read_bintemplates()
-    #where secondary are nans set to primaries
-    sc[np.isnan(sc)]=pr[np.isnan(sc)]
-    #interpolate
-    interpoints=np.array([interpolators[0], interpolators[1] ]).T
-    comb=griddata(interpoints, interpolators[-1] , (pr, sc), method='linear')
-    #rember to assign <15 =primary and > 39= primary
+    pr= np.atleast_1d(np.asarray(pr, dtype=float)).ravel()
+    sc= np.atleast_1d(np.asarray(sc, dtype=float)).ravel()
+    #where secondary are nans set to primaries, without touching the input
+    sc= np.where(np.isnan(sc), pr, sc)
+    spt0, table= _binary_template_table()
+    comb= bilinear_interpolation(spt0, 1., spt0, 1., table, pr, sc, np.empty((pr.size, 1)))[:,0]
+    #templates only exist for secondaries later than their primaries
+    comb[sc < pr]= np.nan
+    #no templates for early or very late primaries
+    out_range= np.logical_or(pr < spt_range[0], pr > spt_range[-1])
+    comb[out_range]= pr[out_range]
     return comb
 
-# Cache for DataFrames
-EVOL_MODEL_CACHE = {}
-#print (EVOL_MODEL_CACHE)
+class PopulationTable(object):
+    """
+    Columnar store for simulated populations: one contiguous typed numpy array per column
+
+    Floating point columns are stored as float_dtype (float32 by default) except the columns in
+    double_columns, booleans stay booleans and strings or objects (e.g. component labels) become
+    pandas categoricals. float32 keeps about 7 significant digits, enough for masses, ages, temperatures
+    and magnitudes (< 1e-5 mag), so positions, distances and velocities are kept in float64 by default
+    (float32 distances are off by ~1 pc at 10 kpc)
+
+    Attributes:
+    ----
+        float_dtype: dtype of floating point columns (numpy dtype)
+        double_columns: columns always kept in float64 (tuple)
+
+    Example:
+    -------
+        > table= PopulationTable()
+        > table['mass']= np.random.uniform(0.01, 0.1, 100)
+        > df= table.to_dataframe()
+    """
+    DOUBLE_COLUMNS=('ra', 'dec', 'l', 'b', 'distance', 'U', 'V', 'W', 'RV', 'mu_alpha_cosdec', 'mu_delta',
+                    'Vr', 'Vphi', 'Vz')
+
+    def __init__(self, float_dtype=np.float32, double_columns=DOUBLE_COLUMNS):
+        self.float_dtype= np.dtype(float_dtype)
+        self.double_columns= tuple(double_columns)
+        self._columns= {}
+
+    def _coerce(self, name, values):
+        if isinstance(values, pd.Categorical):
+            return values
+        if isinstance(values, (pd.Series, pd.Index)):
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                return pd.Categorical(values)
+            values= values.to_numpy()
+        values= np.asarray(values)
+        if values.dtype.kind in 'OUS':
+            return pd.Categorical(values)
+        if values.dtype.kind=='f':
+            dtype= np.float64 if name in self.double_columns else self.float_dtype
+            return np.ascontiguousarray(values, dtype=dtype)
+        return np.ascontiguousarray(values)
+
+    def __setitem__(self, name, values):
+        values= self._coerce(name, values)
+        if values.ndim != 1:
+            raise ValueError('column {} must be one-dimensional'.format(name))
+        if self._columns and len(values) != len(self):
+            raise ValueError('column {} has {} rows, the table has {}'.format(name, len(values), len(self)))
+        self._columns[name]= values
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __delitem__(self, name):
+        del self._columns[name]
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __len__(self):
+        if not self._columns:
+            return 0
+        return len(next(iter(self._columns.values())))
+
+    def keys(self):
+        return list(self._columns.keys())
+
+    def clear(self):
+        self._columns.clear()
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the columns in bytes
+        """
+        return int(sum(v.nbytes for v in self._columns.values()))
+
+    def compress(self, mask):
+        """
+        Keep the rows where mask is True in every column, the old columns are released
+
+        Args:
+        ----
+            mask: one boolean per row (array)
+        """
+        mask= np.asarray(mask, dtype=bool)
+        if mask.shape != (len(self),):
+            raise ValueError('mask has shape {}, the table has {} rows'.format(mask.shape, len(self)))
+        for k, v in self._columns.items():
+            self._columns[k]= v[mask]
+
+    @classmethod
+    def concatenate(cls, tables, nrows):
+        """
+        Concatenate tables with the same columns into preallocated columns, tables can be a generator
+        so that each table is released once it is copied
+
+        Args:
+        ----
+            tables: iterable of PopulationTable
+            nrows: total number of rows (int)
+        Returns:
+        -------
+            PopulationTable
+        """
+        res, start, categoricals= None, 0, {}
+        for table in tables:
+            if res is None:
+                res= cls(float_dtype=table.float_dtype, double_columns=table.double_columns)
+                for k, v in table._columns.items():
+                    if isinstance(v, pd.Categorical):
+                        categoricals[k]= []
+                    else:
+                        res._columns[k]= np.empty(nrows, dtype=v.dtype)
+            stop= start+len(table)
+            for k, v in table._columns.items():
+                if k in categoricals:
+                    categoricals[k].append(v)
+                else:
+                    res._columns[k][start:stop]= v
+            start= stop
+        if res is None:
+            return cls()
+        assert start==nrows, 'the tables have {} rows, expected {}'.format(start, nrows)
+        for k, v in categoricals.items():
+            res._columns[k]= pd.api.types.union_categoricals(v)
+        return res
+
+    def to_dataframe(self, columns=None):
+        """
+        DataFrame view of the table, the columns are not copied
+
+        Args:
+        ----
+            columns: optional, columns to include (list), all by default
+        Returns:
+        -------
+            pandas.DataFrame
+        """
+        columns= self.keys() if columns is None else columns
+        return pd.DataFrame({col: self._columns[col] for col in columns}, copy=False)
+
+
+# Cache for evolutionary models, keyed by model name and logscale columns
+EVOL_MODEL_CACHE = ModelCache(maxsize=4)
+
 def evolutionary_model_interpolator(mass, age, model, subset=None):
-    # Check if DataFrame is in the cache, create it otherwise
-    if model not in EVOL_MODEL_CACHE.keys():
-        evol_model_data = EVOL_MODELS[model]
-        EVOL_MODEL_CACHE[model] = evol_model_data
-    else:
-        evol_model_data = EVOL_MODEL_CACHE[model]
-
-    # Filter data if subset is provided --> pending issue (hybrid cloud not working)
-    #if subset is not None:
-    #    column_index = EVOL_MODELS[model].index(subset[0])
-    #    evol_model_data = evol_model_data[evol_model_data[:, column_index] == subset[1]]
-    #print (model)
-    #print (evol_model_data.keys())
-    values_t = np.log10(evol_model_data['temperature'])  # Temperature values 'age', 'mass', 'luminosity', 'temperature', 'gravity', 'radius'
-    values_lumn = evol_model_data['luminosity']         # Luminosity values
-    values_m = np.log10(evol_model_data['mass'])  # Mass values
-    values_ag = np.log10(evol_model_data['age']) # Age values
-
-    evol_points = np.column_stack((values_m, values_ag))
-
-    teffs = griddata(evol_points, values_t, (np.log10(mass), np.log10(age)), method='linear')
-    lumn = griddata(evol_points, values_lumn, (np.log10(mass), np.log10(age)), method='linear')
+    import astropy.units as u
+    evol_model = EvolutionaryModel.from_name(model)
+
+    # Filter data if subset is provided e.g. ('cloud', 'hybrid')
+    res= evol_model.interpolate('mass', 'age', np.log10(mass), np.log10(age), \
+                                logscale=['mass', 'age', 'temperature'], \
+                                interp_columns=['temperature', 'luminosity'], subset=subset)
+    teffs= res.temperature.values
+    lumn= res.luminosity.values
 
     return {'mass': mass * u.Msun, 'age': age * u.Gyr, 'temperature': 10**teffs * u.Kelvin, 'luminosity': lumn * u.Lsun}
 
+class EvolutionaryGrid(object):
+    """
+    Numeric columns of an evolutionary model, already put on logscale, together with 
+    the triangulations and regular grids built from them
+
+    Attributes:
+    ----
+        columns: names of the numeric columns (list)
+        values: contiguous float64 array (npoints, ncolumns)
+        triangulations: Delaunay triangulations keyed by (axes, subset) (dict)
+        regular_grids: regular resamplings keyed by (x_axis, y_axis, subset, resolution) (dict)
+    """
+    def __init__(self, columns, values):
+        self.columns= list(columns)
+        self.index= {col: idx for idx, col in enumerate(self.columns)}
+        self.values= np.ascontiguousarray(values, dtype=np.float64)
+        self.triangulations= {}
+        self.regular_grids= {}
+        self._subset_values= {}
+
+    def subset_values(self, rows, subset):
+        if rows is None:
+            return self.values
+        if subset not in self._subset_values:
+            self._subset_values[subset]= np.ascontiguousarray(self.values[rows])
+        return self._subset_values[subset]
+
+    @property
+    def nbytes(self):
+        size= self.values.nbytes+sum(v.nbytes for v in self._subset_values.values())
+        for tri in self.triangulations.values():
+            size += tri.points.nbytes+tri.simplices.nbytes+tri.neighbors.nbytes+tri.equations.nbytes
+            #barycentric transforms are only allocated once they are used
+            if getattr(tri, '_transform', None) is not None:
+                size += tri._transform.nbytes
+        for grid in self.regular_grids.values():
+            size += grid['table'].nbytes
+        return size
+
 #need an evolutionary model class that automatically does the interpolations across mass, age and metallicity upon intialization
 class EvolutionaryModel:
-    def __init__(self,  dataframe):
-        #initialize model 
+    def __init__(self,  dataframe, name=None, cache=None):
+        #initialize model from a DataFrame or a dictionary of column arrays (e.g. the memory-mapped EVOL_MODELS grids)
         req_columns=['mass', 'age']
-        assert all(column in dataframe.columns for column in req_columns), "DataFrame is missing required columns"
-        self.columns=np.array(dataframe.columns)
-        self.data = dataframe[self.columns].values
+        columns= list(dataframe.columns) if isinstance(dataframe, pd.DataFrame) else list(dataframe.keys())
+        assert all(column in columns for column in req_columns), "DataFrame is missing required columns"
+        self.columns=np.array(columns)
+        #one array per column, the grids are not copied so memory-mapped columns stay shared between processes
+        self._grid={col: (dataframe[col].to_numpy() if isinstance(dataframe, pd.DataFrame) else dataframe[col]) \
+                    for col in columns}
+        #named models share prepared grids through the global cache
+        self.name=name
+        if cache is None:
+            cache= EVOL_MODEL_CACHE if name is not None else ModelCache(maxsize=4)
+        self.cache=cache
+        #row indices of (column, value) subsets
+        self._subsets={}
+
+    @classmethod
+    def from_name(cls, name):
+        """
+        Evolutionary model from the grids shipped with the package e.g. 'baraffe2003'
+        """
+        return cls(EVOL_MODELS[name], name=name)
+
+    def __reduce__(self):
+        #named models are pickled by name, worker processes memory-map the grid instead of receiving a copy
+        if self.name is not None and self.name in EVOL_MODELS:
+            return (self.__class__.from_name, (self.name,))
+        return super().__reduce__()
+
+    @property
+    def data(self):
+        """
+        All columns as one (npoints, ncolumns) array, object dtype if some columns are not numeric.
+        This copies the grid, the interpolations only read the numeric columns
+        """
+        return pd.DataFrame(self._grid, copy=False)[list(self.columns)].values
+
+    def _subset_rows(self, subset):
+        if subset is None:
+            return None
+        column, value= subset
+        if (column, value) not in self._subsets:
+            assert column in self.columns, f"subset column '{column}' not found in DataFrame columns"
+            rows= np.flatnonzero(np.asarray(self._grid[column]) == value)
+            if len(rows)==0:
+                raise ValueError(f"no grid points with {column} = {value}")
+            self._subsets[(column, value)]= rows
+        return self._subsets[(column, value)]
+
+    def _numeric_columns(self, exclude=[]):
+        columns=[]
+        for col in self.columns:
+            if col in exclude: continue
+            values= self._grid[col]
+            if values.dtype.kind in 'biuf':
+                columns.append(col)
+                continue
+            try:
+                np.asarray(values[:1]).astype(float)
+                columns.append(col)
+            except ValueError:
+                #categorical columns cannot be interpolated
+                pass
+        return columns
+
+    def prepared_grid(self, logscale=['mass', 'age', 'temperature']):
+        """
+        Numeric columns on logscale, cached by model name and logscale columns
+
+        Args:
+        ----
+            logscale: optional, columns put on a log10 scale (list)
+        Returns:
+        -------
+            EvolutionaryGrid object
+
+        Examples:
+        --------
+            > grid= model.prepared_grid(['mass', 'age', 'temperature'])
+            > grid.values[:, grid.index['temperature']]
+        """
+        logscale= tuple(sorted(logscale))
+
+        def prepare():
+            #filled column by column from the (memory-mapped) grid, categorical columns are never read
+            columns= self._numeric_columns()
+            values= np.empty((len(self._grid[columns[0]]), len(columns)))
+            for idx, col in enumerate(columns):
+                values[:, idx]= self._grid[col]
+                if col in logscale:
+                    np.log10(values[:, idx], out=values[:, idx])
+            return EvolutionaryGrid(columns, values)
+
+        return self.cache.get((self.name, logscale), prepare)
+
+    def triangulation(self, x_axis, y_axis, logscale=['mass', 'age', 'temperature'], z_axis=None, subset=None):
+        """
+        Delaunay triangulation of the (x_axis, y_axis) or (x_axis, y_axis, z_axis) grid points
+
+        The triangulation is computed once per combination of axes, logscale columns and subset
+        and cached with the prepared grid
+
+        Args:
+        ----
+            x_axis, y_axis: column names of the interpolation axes (str)
+            logscale: optional, columns put on a log10 scale (list)
+            z_axis: optional, third interpolation axis e.g. 'metallicity' (str)
+            subset: optional, only use grid points where column == value e.g. ('cloud', 'hybrid') (tuple)
+        Returns:
+        -------
+            scipy.spatial.Delaunay object
+
+        Examples:
+        --------
+            > tri= model.triangulation('mass', 'age')
+            > tri= model.triangulation('mass', 'age', z_axis='metallicity', subset=('cloud', 'nc'))
+        """
+        grid= self.prepared_grid(logscale)
+        axes= (x_axis, y_axis) if z_axis is None else (x_axis, y_axis, z_axis)
+        key=(axes, subset)
+        if key not in grid.triangulations:
+            from scipy.spatial import Delaunay
+            values= grid.subset_values(self._subset_rows(subset), subset)
+            grid.triangulations[key]= Delaunay(values[:, [grid.index[ax] for ax in axes]])
+        return grid.triangulations[key]
+
+    def regular_grid(self, x_axis, y_axis, logscale=['mass', 'age', 'temperature'], resolution=(256, 256), subset=None):
+        """
+        Resample the model onto a regular (x_axis, y_axis) grid for constant-time lookups
+
+        All numeric columns are resampled once with the triangulation and the result is cached.
+        The maximum deviation between bilinear lookups and the triangulation at the centers of 
+        the grid cells is reported for each column
+
+        Args:
+        ----
+            x_axis, y_axis: column names of the grid axes (str)
+            logscale: optional, columns put on a log10 scale (list)
+            resolution: optional, number of grid nodes along x and y (tuple of int)
+            subset: optional, only use grid points where column == value e.g. ('cloud', 'hybrid') (tuple)
+        Returns:
+        -------
+            dictionary with the grid origin and spacing ('x0', 'dx', 'y0', 'dy'), the 'table' of 
+            values (nx, ny, ncolumns), the 'columns' and their 'max_deviation'
+
+        Examples:
+        --------
+            > grid= model.regular_grid('mass', 'age', resolution=(512, 512))
+            > grid['max_deviation']['temperature']
+        """
+        prepared= self.prepared_grid(logscale)
+        key=(x_axis, y_axis, subset, tuple(resolution))
+        if key in prepared.regular_grids:
+            return prepared.regular_grids[key]
+
+        tri= self.triangulation(x_axis, y_axis, logscale=logscale, subset=subset)
+        columns= [col for col in prepared.columns if col not in [x_axis, y_axis]]
+        values= prepared.subset_values(self._subset_rows(subset), subset)[:, [prepared.index[col] for col in columns]]
+
+        nx, ny= resolution
+        xmin, ymin= np.nanmin(tri.points, axis=0)
+        xmax, ymax= np.nanmax(tri.points, axis=0)
+        dx= (xmax-xmin)/(nx-1)
+        dy= (ymax-ymin)/(ny-1)
+        xnodes, ynodes= np.meshgrid(xmin+dx*np.arange(nx), ymin+dy*np.arange(ny), indexing='ij')
+        vertices, weights= simplex_barycentric_weights(tri, xnodes.flatten(), ynodes.flatten())
+        table= np.ascontiguousarray(apply_barycentric_weights(vertices, weights, values).reshape(nx, ny, len(columns)))
+
+        #compare to the triangulation at the centers of the cells
+        xcenter, ycenter= (xnodes[:-1, :-1]+dx/2).flatten(), (ynodes[:-1, :-1]+dy/2).flatten()
+        vertices, weights= simplex_barycentric_weights(tri, xcenter, ycenter)
+        exact= apply_barycentric_weights(vertices, weights, values)
+        approx= bilinear_interpolation(xmin, dx, ymin, dy, table, xcenter, ycenter, np.empty_like(exact))
+        with np.errstate(invalid='ignore'):
+            deviation= np.abs(approx-exact)
+        max_deviation={col: (np.nanmax(deviation[:, idx]) if np.isfinite(deviation[:, idx]).any() else np.nan) \
+                       for idx, col in enumerate(columns)}
+
+        prepared.regular_grids[key]={'x0': xmin, 'dx': dx, 'y0': ymin, 'dy': dy, 'table': table,
+                                     'columns': columns, 'max_deviation': max_deviation}
+        return prepared.regular_grids[key]
+
+    def _interpolate_columns(self, x_axis, y_axis, x_values, y_values, logscale, columns, method, resolution, \
+                             z_axis=None, z_values=None, subset=None):
+        #interpolate columns for a single subset, returns a dictionary of arrays
+        if method=='grid':
+            if z_axis is not None:
+                raise ValueError("method='grid' only supports two interpolation axes")
+            grid= self.regular_grid(x_axis, y_axis, logscale=logscale, resolution=resolution, subset=subset)
+            table= np.ascontiguousarray(grid['table'][:, :, [grid['columns'].index(col) for col in columns]])
+            interpolated= bilinear_interpolation(grid['x0'], grid['dx'], grid['y0'], grid['dy'], table, \
+                                                 x_values, y_values, np.empty((x_values.size, len(columns))))
+            return {col: interpolated[:, idx] for idx, col in enumerate(columns)}
+
+        prepared= self.prepared_grid(logscale)
+        tri= self.triangulation(x_axis, y_axis, logscale=logscale, z_axis=z_axis, subset=subset)
+        values= prepared.subset_values(self._subset_rows(subset), subset)[:, [prepared.index[col] for col in columns]]
+        coordinates= [x_values, y_values] if z_axis is None else [x_values, y_values, z_values]
+
+        if method=='barycentric':
+            #stack all columns and apply the same weights to all of them
+            vertices, weights= simplex_barycentric_weights(tri, *coordinates)
+            interpolated=apply_barycentric_weights(vertices, weights, values)
+            return {col: interpolated[:, idx] for idx, col in enumerate(columns)}
+
+        if method=='linear':
+            if z_axis is not None:
+                raise ValueError("method='linear' only supports two interpolation axes")
+            return {col: fast_2d_interpolation(tri, values[:, idx], x_values, y_values) \
+                    for idx, col in enumerate(columns)}
+
+        raise ValueError("method must be 'barycentric', 'linear' or 'grid'")
 
     def interpolate(self, x_axis, y_axis, x_values, y_values, \
-                    logscale=['mass', 'age', 'temperature'], interp_columns=['temperature']):
-        
-        assert x_axis in self.columns, f"x_axis '{x_axis}' not found in DataFrame columns"
-        assert y_axis in self.columns, f"y_axis '{y_axis}' not found in DataFrame columns"
-        
-        #make a copy of data 
-        #put stuff on logscale
-        dt= self.data.copy()
-        for c in logscale:
-            col_idx = np.where(self.columns == c)[0][0]
-            dt[:, col_idx] =np.log10(np.array(dt[:, col_idx]).astype(float))
-            
-        points = dt[:, [np.where(self.columns == x_axis)[0][0], np.where(self.columns == y_axis)[0][0]]]
-        remaining_columns = [col for col in interp_columns if col not in [x_axis, y_axis]]
-        results = {}
+                    logscale=['mass', 'age', 'temperature'], interp_columns=['temperature'], method='barycentric',
+                    resolution=(256, 256), z_axis=None, z_values=None, subset=None, as_dict=False):
+        """
+        Interpolate the model grid at (x_values, y_values) or (x_values, y_values, z_values)
+
+        Args:
+        ----
+            x_axis, y_axis: column names of the interpolation axes (str)
+            x_values, y_values: coordinates to interpolate at, on the same scale as the axes (arrays)
+            logscale: optional, columns put on a log10 scale (list)
+            interp_columns: optional, columns to interpolate (list)
+            method: optional, 'barycentric' locates simplices and weights once and interpolates all columns 
+                    in a single product, 'linear' interpolates each column separately, 'grid' uses bilinear 
+                    lookups on a cached regular resampling of the model (see regular_grid) (str)
+            resolution: optional, number of grid nodes along x and y for method='grid' (tuple of int)
+            z_axis, z_values: optional, third axis and coordinates e.g. 'metallicity' (str, array), 
+                    only supported by method='barycentric'
+            subset: optional, (column, value) restricts the grid to points where column == value e.g. ('cloud', 'nc'),
+                    value can also be an array with one entry per point, each group is then interpolated 
+                    on its own cached subset (tuple)
+            as_dict: optional, return a dictionary of arrays instead of a DataFrame, avoids copying 
+                    the results for large batches (bool)
+        Returns:
+        -------
+            DataFrame (or dictionary) of interpolated columns
+
+        Examples:
+        --------
+            > res= model.interpolate('mass', 'age', np.log10(mass), np.log10(age), interp_columns=['temperature', 'luminosity'])
+            > res= model.interpolate('mass', 'age', np.log10(mass), np.log10(age), z_axis='metallicity', z_values=met,
+                                     subset=('cloud', 'nc'))
+        """
+        for ax in [x_axis, y_axis, z_axis]:
+            assert ax is None or ax in self.columns, f"axis '{ax}' not found in DataFrame columns"
         
-        for col in remaining_columns:
-            col_idx = np.where(self.columns == col)[0][0]
-            values =dt[:, col_idx]
-            #result = np.empty_like(y_values)
-            #interp_values= interpolate_2d(points, values, x_values, y_values, result)
-            results[col] = fast_2d_interpolation(points, values, x_values, y_values)
+        remaining_columns = [col for col in interp_columns if col not in [x_axis, y_axis, z_axis]]
+        xs= np.asarray(x_values, dtype=float).ravel()
+        ys= np.asarray(y_values, dtype=float).ravel()
+        zs= None if z_values is None else np.asarray(z_values, dtype=float).ravel()
+
+        if subset is not None and np.ndim(subset[1]) > 0:
+            #one subset per point: split the points by value and reuse the cached subsets
+            column, labels= subset[0], np.asarray(subset[1]).ravel()
+            results = {col: np.full(len(xs), np.nan) for col in remaining_columns}
+            for value in pd.unique(labels):
+                sel= labels == value
+                part= self._interpolate_columns(x_axis, y_axis, xs[sel], ys[sel], logscale, remaining_columns, \
+                                                method, resolution, z_axis=z_axis, \
+                                                z_values=None if zs is None else zs[sel], subset=(column, value))
+                for col in remaining_columns:
+                    results[col][sel]= part[col]
+        else:
+            results= self._interpolate_columns(x_axis, y_axis, xs, ys, logscale, remaining_columns, method, \
+                                               resolution, z_axis=z_axis, z_values=zs, subset=subset)
+
+        if as_dict:
+            results[x_axis]= xs
+            results[y_axis]= ys
+            if z_axis is not None:
+                results[z_axis]= zs
+            return results
             
         interp_df= pd.DataFrame(results)
         interp_df[x_axis]=x_values
         interp_df[y_axis]=y_values
-        return interp_df
\ No newline at end of file
+        if z_axis is not None:
+            interp_df[z_axis]=z_values
+        return interp_df
@@ -5,17 +5,206 @@ from .constants import *
 import functools
 import numba
 from numba import njit
-from scipy.interpolate import interp1d, griddata, InterpolatedUnivariateSpline
+#scipy is imported inside the functions that need it to keep the import of the package cheap
 
+#names re-exported by the popsims package
+__all__=['get_rng', 'get_seed_sequence', 'spawn_rngs', 'ModelCache', 'content_key', 'sample_from_powerlaw',
+         'sample_from_broken_powerlaw', 'random_draw', 'make_spt_number', 'random_normal_angles', 'random_angles',
+         'get_distance', 'trapzl', 'dropnans', 'group_by', 'k_clip_fit', 'fast_2d_interpolation',
+         'simplex_barycentric_weights', 'apply_barycentric_weights', 'bilinear_interpolation', 'EPSILON',
+         'barycentric_weights', 'interpolate_2d', 'compile_polynomial_relation', 'apply_polynomial_relation',
+         'compile_poly1d_relations', 'evaluate_poly1d_relations', 'polynomial_mean_and_scatter',
+         'inverse_polynomial_table', 'inverse_polynomial_relation']
 
-def sample_from_powerlaw(alpha, xmin=0.1, xmax=1, nsample=int(1e4)):
+
+def get_rng(seed=None):
+    """
+    Random number generator from a seed
+    Args:
+    ----
+        seed: None, an integer, a np.random.SeedSequence or a np.random.Generator (returned as is).
+              None draws the seed from the global numpy state, so np.random.seed keeps runs reproducible
+    Returns:
+    -------
+        np.random.Generator
+
+    Examples:
+    --------
+        > rng= get_rng(42)
+        > x= sample_from_powerlaw(-0.6, nsample=100, rng=rng)
+    """
+    if isinstance(seed, np.random.Generator):
+        return seed
+    if seed is None:
+        seed= np.random.randint(0, 2**31-1, size=4)
+    return np.random.default_rng(seed)
+
+def get_seed_sequence(seed=None):
+    """
+    np.random.SeedSequence from a seed
+    Args:
+    ----
+        seed: None, an integer, a np.random.SeedSequence (returned as is) or a np.random.Generator (used to draw the entropy)
+    Returns:
+    -------
+        np.random.SeedSequence
+
+    Examples:
+    --------
+        > seq= get_seed_sequence(42)
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(0, 2**63-1, size=4))
+    if seed is None:
+        return np.random.SeedSequence(np.random.randint(0, 2**31-1, size=4))
+    return np.random.SeedSequence(seed)
+
+def spawn_rngs(seed, n, start=0):
+    """
+    Independent child generators for parallel streams, using np.random.SeedSequence.spawn
+    Args:
+    ----
+        seed: None, an integer, a np.random.SeedSequence or a np.random.Generator
+        n: number of child streams (int)
+        start: optional, index of the first child stream, child i is the same whatever start and n (int)
+    Returns:
+    -------
+        list of np.random.Generator
+
+    Examples:
+    --------
+        > rngs= spawn_rngs(42, 8)
+        > rngs[3].random() == spawn_rngs(42, 1, start=3)[0].random()
+    """
+    seq= get_seed_sequence(seed)
+    #same children as seq.spawn, without depending on how many were spawned before
+    return [np.random.default_rng(np.random.SeedSequence(seq.entropy, spawn_key=tuple(seq.spawn_key)+(i,), pool_size=seq.pool_size))
+            for i in range(int(start), int(start)+int(n))]
+
+
+class ModelCache(object):
+    """
+    Bounded least-recently-used cache, used for prepared evolutionary model grids and compiled relations
+
+    Attributes:
+    ----
+        maxsize: maximum number of entries (int)
+        maxbytes: optional, maximum total size of the entries in bytes (int)
+        hits, misses: number of cache hits and misses (int)
+
+    Example:
+    -------
+        > cache= ModelCache(maxsize=4)
+        > grid= cache.get(('baraffe2003', ('age', 'mass')), lambda: EvolutionaryGrid(...))
+        > cache.stats()
     """
-    Sample values from power law $x ~ x^alpha$
+    def __init__(self, maxsize=4, maxbytes=None):
+        from collections import OrderedDict
+        self.maxsize= maxsize
+        self.maxbytes= maxbytes
+        self.hits= 0
+        self.misses= 0
+        self._entries= OrderedDict()
+
+    def get(self, key, factory):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        else:
+            self.misses += 1
+            self._entries[key]= factory()
+        self._evict()
+        return self._entries[key]
+
+    def _evict(self):
+        #always keep the most recently used entry
+        while len(self._entries) > 1 and (len(self._entries) > self.maxsize or \
+                                          (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            self._entries.popitem(last=False)
+
+    @property
+    def nbytes(self):
+        return sum(_nbytes(entry) for entry in self._entries.values())
+
+    def keys(self):
+        return self._entries.keys()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits= 0
+        self.misses= 0
+
+    def stats(self):
+        """
+        Cache statistics: hits, misses, number of entries and their size in bytes
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+                'maxsize': self.maxsize, 'nbytes': self.nbytes}
+
+def _nbytes(obj):
+    #size of the arrays held by an object, a tuple or a dictionary
+    if isinstance(obj, (tuple, list)):
+        return sum(_nbytes(v) for v in obj)
+    if isinstance(obj, dict):
+        return sum(_nbytes(v) for v in obj.values())
+    return int(getattr(obj, 'nbytes', 0))
+
+def content_key(obj):
+    """
+    Hashable digest of the contents of nested dictionaries, lists and arrays, used to cache
+    values computed from relations whatever the identity of the dictionary holding them
     Args:
     ----
-        alpha: power-law index (float)
+        obj: dictionary, list, array or scalar
+    Returns:
+    -------
+        hex digest (str)
+
+    Examples:
+    --------
+        > content_key(POLYNOMIALS['absmags_spt']['dwarfs']['VISTA_J'])
+    """
+    import hashlib
+    digest= hashlib.blake2b(digest_size=16)
+
+    def update(o):
+        if isinstance(o, dict):
+            digest.update(b'{')
+            for k in sorted(o.keys(), key=str):
+                update(k)
+                update(o[k])
+            digest.update(b'}')
+        elif isinstance(o, (list, tuple)):
+            digest.update(b'[')
+            for v in o:
+                update(v)
+            digest.update(b']')
+        elif isinstance(o, np.ndarray):
+            digest.update(str((o.dtype.str, o.shape)).encode())
+            digest.update(np.ascontiguousarray(o).tobytes())
+        else:
+            digest.update(repr(o).encode())
+            digest.update(b',')
+    update(obj)
+    return digest.hexdigest()
+
+def sample_from_powerlaw(alpha, xmin=0.1, xmax=1, nsample=int(1e4), rng=None):
+    """
+    Sample values from power law $x ~ x^alpha$ by analytic inverse-transform sampling
+    Args:
+    ----
+        alpha: power-law index (float), alpha=-1 is sampled uniformly in log x
         xmin, xmax:  optional, minium and maximu values (float)
         nsample: number of samples (integer)
+        rng: optional, seed or np.random.Generator (see get_rng)
     Returns:
     -------
         random draws
@@ -24,15 +213,79 @@ def sample_from_powerlaw(alpha, xmin=0.1, xmax=1, nsample=int(1e4)):
     --------
         > x = sample_from_powerlaw(alpha, xmin=0.1, xmax=1, nsample=int(1e3))
     """
-    x= np.linspace(xmin, xmax, int(1e6))
-    pdf=x**alpha
-    cdf=np.cumsum(pdf)
-    cdf=cdf/np.nanmax(cdf)
-    return random_draw(x, cdf, nsample=int(nsample))
+    u= get_rng(rng).random(int(nsample))
+    return _powerlaw_inverse_cdf(u, alpha, xmin, xmax)
+
+def _powerlaw_inverse_cdf(u, alpha, xmin, xmax):
+    #inverse of the cdf of x^alpha between xmin and xmax evaluated at u in [0, 1]
+    if alpha == -1:
+        if xmin <= 0:
+            raise ValueError('xmin must be positive for alpha = -1')
+        return xmin*(xmax/xmin)**u
+    a1= alpha+1.
+    if xmin <= 0 and a1 < 0:
+        raise ValueError('xmin must be positive for alpha < -1')
+    lo, hi= float(xmin)**a1, float(xmax)**a1
+    return (lo+u*(hi-lo))**(1./a1)
+
+def _powerlaw_integral(alpha, xmin, xmax):
+    #integral of x^alpha between xmin and xmax
+    if alpha == -1:
+        return np.log(xmax/xmin)
+    return (float(xmax)**(alpha+1.)-float(xmin)**(alpha+1.))/(alpha+1.)
+
+def sample_from_broken_powerlaw(alphas, breaks, xmin=None, xmax=None, nsample=int(1e4), rng=None):
+    """
+    Sample values from a continuous broken power law by analytic inverse-transform sampling
 
+    The segments $x ~ x^alphas[i]$ between breaks[i] and breaks[i+1] are joined continuously, 
+    each draw picks a segment according to its integral and is then inverted exactly within it
+    Args:
+    ----
+        alphas: power-law indices of the segments (list, size K)
+        breaks: segment boundaries in increasing order (list, size K+1)
+        xmin, xmax: optional, truncate the distribution to [xmin, xmax] (floats)
+        nsample: number of samples (integer)
+        rng: optional, seed or np.random.Generator (see get_rng)
+    Returns:
+    -------
+        random draws
 
-@numba.njit
-def random_draw(x_grid, cdf, nsample=10):
+    Examples:
+    --------
+        > #Kroupa (2001)-like IMF between 0.01 and 1 Msun
+        > m= sample_from_broken_powerlaw([-0.3, -1.3, -2.3], [0.03, 0.08, 0.5, 100], xmin=0.01, xmax=1, nsample=1000)
+    """
+    alphas= np.asarray(alphas, dtype=float)
+    breaks= np.asarray(breaks, dtype=float)
+    assert len(breaks)==len(alphas)+1, 'breaks must have one more element than alphas'
+    #normalization of each segment for continuity at the breaks
+    norms= np.ones(len(alphas))
+    for i in range(1, len(alphas)):
+        norms[i]= norms[i-1]*breaks[i]**(alphas[i-1]-alphas[i])
+    #truncate
+    lows= breaks[:-1] if xmin is None else np.maximum(breaks[:-1], xmin)
+    highs= breaks[1:] if xmax is None else np.minimum(breaks[1:], xmax)
+    keep= highs > lows
+    if not keep.any():
+        raise ValueError('empty range [{}, {}]'.format(xmin, xmax))
+    alphas, norms, lows, highs= alphas[keep], norms[keep], lows[keep], highs[keep]
+
+    weights= np.array([n*_powerlaw_integral(a, lo, hi) for a, n, lo, hi in zip(alphas, norms, lows, highs)])
+    cumweights= np.cumsum(weights)/np.sum(weights)
+    u= get_rng(rng).random(int(nsample))
+    segment= np.minimum(np.searchsorted(cumweights, u, side='right'), len(weights)-1)
+    #rescale the uniform draw within the segment
+    start= np.concatenate([[0.], cumweights[:-1]])
+    v= np.clip((u-start[segment])/(cumweights[segment]-start[segment]), 0., 1.)
+    x= np.empty(int(nsample))
+    for idx in range(len(weights)):
+        sel= segment==idx
+        x[sel]= _powerlaw_inverse_cdf(v[sel], alphas[idx], lows[idx], highs[idx])
+    return x
+
+
+def random_draw(x_grid, cdf, nsample=10, rng=None):
     """
     1D- Random draw by using numpy search on a grid
     Args:
@@ -40,6 +293,7 @@ def random_draw(x_grid, cdf, nsample=10):
         x_grid: grid of values ( array)
         cdf:  corresponding values from the CDF
         nsample: optional, number of samples
+        rng: optional, seed or np.random.Generator (see get_rng)
     Returns:
     -------
         random draws
@@ -50,7 +304,11 @@ def random_draw(x_grid, cdf, nsample=10):
         > cdf = x**3/(x[-1]**3)
         > res= random_draw(x, cdf)
     """
-    values = np.random.rand(nsample)
+    values = get_rng(rng).random(int(nsample))
+    return _draw_from_cdf(np.asarray(x_grid), np.asarray(cdf), values)
+
+@numba.njit(cache=True)
+def _draw_from_cdf(x_grid, cdf, values):
     value_bins = np.searchsorted(cdf, values)
     random_from_cdf = x_grid[value_bins]
     return random_from_cdf
@@ -81,22 +339,23 @@ def make_spt_number(spt):
     else:
         return spt
     
-def random_normal_angles(num_samples):
+def random_normal_angles(num_samples, rng=None):
     # Generate random points on the surface of a sphere
-    points = np.random.normal(size=(num_samples, 3))
+    points = get_rng(rng).normal(size=(num_samples, 3))
     points /= np.linalg.norm(points, axis=1)[:, np.newaxis]
     # Convert points to polar coordinates
     theta = np.arccos(points[:, 2])
     phi = np.arctan2(points[:, 1], points[:, 0])
     return theta, phi
 
-def random_angles(num_samples):
-    np.random.seed(0)
-    theta = np.arccos(2 * np.random.rand(num_samples) - 1) - np.pi/2
-    phi = np.random.rand(num_samples) * 2 * np.pi
+def random_angles(num_samples, rng=None):
+    rng= get_rng(rng)
+    theta = np.arccos(2 * rng.random(num_samples) - 1) - np.pi/2
+    phi = rng.random(num_samples) * 2 * np.pi
     return phi-np.pi, theta
     
-@numba.vectorize("float64(float64, float64)", target='cpu')
+#compiled for the input types on first call rather than at import, and cached on disk
+@numba.vectorize(target='cpu', cache=True)
 def get_distance(absmag, appmag):
     """
     Distance from absolute magnitude and apparent magnitude
@@ -116,7 +375,7 @@ def get_distance(absmag, appmag):
 
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 #@numba.jit(nopython=True, parallel=True) --> fails due to numba issues
 def trapzl(y, x):
     """
@@ -216,72 +475,121 @@ def k_clip_fit(x, y, sigma_y, sigma = 5, n=6):
         not_clipped[remove] = 0   
     return  not_clipped, best_fit
 
-def apply_polynomial_relation_gpt(pol, x, xerr=0.0, nsample=100):
-    x = np.array(x)
-    size = 0
-
-    if x.size == 1:
-        size = -1
-
-    x = np.random.normal(x, xerr, (int(nsample), len(np.atleast_1d(x))))
-    
-    results = [
-        (coeffs * (x - xshift)[:, None] ** np.arange(len(coeffs))) 
-        for k in pol.keys()
-        for xshift, coeffs, scatter in [
-            (pol[k]['xshift'], pol[k]['coeffs'], pol[k]['yerr'])
-        ]
-        for lowlim, uplim in [
-            (float(k.split('_')[0]) - xshift, float(k.split('_')[-1]) - xshift)
-        ]
-        if np.logical_and(x - xshift >= lowlim, x - xshift <= uplim).any()
-    ]
-
-    ans = np.nansum(results, axis=1)
-    res = np.nanmedian(
-        [
-            np.random.normal(a, scatter)
-            for a, scatter in zip(ans, [pol[k]['yerr'] for k in pol.keys()])
-        ],
-        axis=0,
-    )
-
-    if size == -1:
-        return np.nanmedian(res.flatten()), np.nanstd(res.flatten())
-
-    return np.nanmedian(res, axis=0), np.nanstd(res, axis=0)
-
-def inverse_polynomial_relation_gpt(pol, y, xgrid, nsample=1000, interpolation='griddata'):
-    ygrid, yunc = apply_polynomial_relation(pol, xgrid, xerr=0.0, nsample=nsample)
-
-    # Remove nans
-    nans = np.logical_or(np.isnan(ygrid), np.isnan(yunc))
-
-    # Reshape
-    rand_y = np.random.normal(ygrid[~nans], yunc[~nans], size=(int(nsample), len(yunc[~nans]))).flatten()
-    rand_x = np.broadcast_to(xgrid[~nans], (int(nsample), len(yunc[~nans]))).flatten()
-
-    # Interpolation methods
-    interpolation_methods = {
-        'griddata': lambda y: griddata(rand_y, rand_x, y, fill_value=np.nan, method='linear', rescale=True),
-        'spline': lambda y: (
-            lambda f: f(y)
-        )(
-            InterpolatedUnivariateSpline(
-                *zip(*sorted(zip(rand_y[~np.isnan(rand_y)], rand_x[~np.isnan(rand_y)]))),
-                ext='const', k=1
-            )
-        )
-    }
-
-    return interpolation_methods[interpolation](y)
-
 #play with interpolators here
 def fast_2d_interpolation(points, values, x_values, y_values):
+    """
+    Linear interpolation over scattered 2D points
+    Args:
+    ----
+        points: grid points (array, shape (N, 2)) or a prebuilt scipy.spatial.Delaunay
+                triangulation of these points (reused instead of rebuilt on every call)
+        values: values at the grid points (array, N)
+        x_values, y_values: coordinates to interpolate at (arrays)
+    Returns:
+    -------
+        interpolated values, nans outside the convex hull of the grid
+
+    Examples:
+    --------
+        > tri= Delaunay(points)
+        > vals= fast_2d_interpolation(tri, values, x, y)
+    """
+    from scipy.interpolate import griddata, LinearNDInterpolator
+    from scipy.spatial import Delaunay
+    if isinstance(points, Delaunay):
+        return LinearNDInterpolator(points, values)((x_values, y_values)).flatten()
     return griddata(points, values, (x_values, y_values), method='linear').flatten()
 
+def simplex_barycentric_weights(tri, x_values, y_values, *other_values):
+    """
+    Locate the simplices containing the query points and their barycentric weights
+    Args:
+    ----
+        tri: scipy.spatial.Delaunay triangulation of the grid points (2D or ND)
+        x_values, y_values: coordinates to interpolate at (arrays, size M)
+        other_values: optional, coordinates along additional axes for N-dimensional triangulations (arrays, size M)
+    Returns:
+    -------
+        tuple of vertex indices (M, ndim+1) and barycentric weights (M, ndim+1),
+        weights are nans for points outside the convex hull
+
+    Examples:
+    --------
+        > vertices, weights= simplex_barycentric_weights(tri, x, y)
+        > vals= apply_barycentric_weights(vertices, weights, values)
+    """
+    xi=np.column_stack([np.ravel(x_values), np.ravel(y_values)]+[np.ravel(v) for v in other_values]).astype(float)
+    ndim=tri.ndim
+    simplex=tri.find_simplex(xi)
+    outside= simplex < 0
+    #affine transforms to barycentric coordinates
+    transform=tri.transform[simplex]
+    bary=np.einsum('ijk,ik->ij', transform[:, :ndim, :], xi-transform[:, ndim, :])
+    weights=np.column_stack([bary, 1.-bary.sum(axis=1)])
+    weights[outside]=np.nan
+    vertices=tri.simplices[simplex]
+    return vertices, weights
+
+def apply_barycentric_weights(vertices, weights, values):
+    """
+    Interpolate one or several columns with precomputed barycentric weights
+    Args:
+    ----
+        vertices, weights: output of simplex_barycentric_weights (arrays, (M, ndim+1))
+        values: values at the grid points (array, N or (N, ncolumns))
+    Returns:
+    -------
+        interpolated values (array, M or (M, ncolumns))
+
+    Examples:
+    --------
+        > vertices, weights= simplex_barycentric_weights(tri, x, y)
+        > vals= apply_barycentric_weights(vertices, weights, values)
+    """
+    values=np.asarray(values, dtype=float)
+    if values.ndim ==1:
+        return np.einsum('ij,ij->i', weights, values[vertices])
+    return np.einsum('ij,ijk->ik', weights, values[vertices])
+
+@numba.njit(parallel=True, cache=True)
+def bilinear_interpolation(x0, dx, y0, dy, table, x_values, y_values, result):
+    """
+    Bilinear interpolation on a regular grid by direct index arithmetic
+    Args:
+    ----
+        x0, dx: first node and spacing of the grid along x (floats)
+        y0, dy: first node and spacing of the grid along y (floats)
+        table: values on the grid nodes (array, (nx, ny, ncolumns))
+        x_values, y_values: coordinates to interpolate at (arrays, size M)
+        result: output array (array, (M, ncolumns)), nans outside the grid
+    Returns:
+    -------
+        result
+
+    Examples:
+    --------
+        > res= bilinear_interpolation(0., 1., 0., 1., table, x, y, np.empty((len(x), table.shape[-1])))
+    """
+    nx, ny, ncols= table.shape
+    for i in numba.prange(x_values.shape[0]):
+        fx=(x_values[i]-x0)/dx
+        fy=(y_values[i]-y0)/dy
+        #also catches nans
+        if not (fx >= 0. and fx <= nx-1 and fy >= 0. and fy <= ny-1):
+            for k in range(ncols):
+                result[i, k]=np.nan
+            continue
+        ix=min(int(fx), nx-2)
+        iy=min(int(fy), ny-2)
+        tx=fx-ix
+        ty=fy-iy
+        for k in range(ncols):
+            result[i, k]=(1.-tx)*(1.-ty)*table[ix, iy, k]+tx*(1.-ty)*table[ix+1, iy, k]+\
+                          (1.-tx)*ty*table[ix, iy+1, k]+tx*ty*table[ix+1, iy+1, k]
+    return result
+
 EPSILON = 1e-10
-@njit
+@njit(cache=True)
 def barycentric_weights(points, x_values, y_values):
     n = points.shape[0]
     m = x_values.shape[0]
@@ -299,7 +607,7 @@ def barycentric_weights(points, x_values, y_values):
 
     return weights
 
-@njit
+@njit(cache=True)
 def interpolate_2d(points, values, x_values, y_values, result):
     weights = barycentric_weights(points, x_values, y_values)
     n, m, l = weights.shape
@@ -314,101 +622,298 @@ def interpolate_2d(points, values, x_values, y_values, result):
     return result
 
 
-def apply_polynomial_relation(pol, x, xerr=0.0, nsample=100):
+#compiled relations, inverse tables and compiled fits keyed by the contents of the relations
+_RELATION_CACHE=ModelCache(maxsize=128)
+
+def compile_polynomial_relation(pol):
     """
-    1D- Random draw by using numpy search on a grid
+    Pack a piecewise polynomial relation into arrays, built once per relation
     Args:
     ----
-        x_grid: grid of values ( array)
-        cdf:  corresponding values from the CDF
-        nsample: optional, number of samples
+        pol: piecewise polynomial relation ({'lo_hi': {'coeffs', 'xshift', 'yerr'}})
     Returns:
     -------
-        random draws
+        lowlims, uplims, xshifts, scatters (arrays of length nsegments),
+        coeffs (nsegments, max number of coefficients) in increasing order, zero-padded
 
     Examples:
     --------
-        > x = np.arange(0, 10)
-        > cdf = x**3/(x[-1]**3)
-        > res= random_draw(x, cdf)
+        > lowlims, uplims, xshifts, scatters, coeffs= compile_polynomial_relation(pol)
+    """
+    def pack():
+        keys= list(pol.keys())
+        ncoeffs= max(len(pol[k]['coeffs']) for k in keys)
+        lowlims= np.array([float(k.split('_')[0]) for k in keys])
+        uplims= np.array([float(k.split('_')[-1]) for k in keys])
+        xshifts= np.array([pol[k]['xshift'] for k in keys], dtype=float)
+        scatters= np.array([pol[k]['yerr'] for k in keys], dtype=float)
+        coeffs= np.zeros((len(keys), ncoeffs))
+        for idx, k in enumerate(keys):
+            coeffs[idx, :len(pol[k]['coeffs'])]= pol[k]['coeffs']
+        return lowlims, uplims, xshifts, scatters, coeffs
+
+    return _RELATION_CACHE.get(('polynomial', content_key(pol)), pack)
+
+@numba.njit(cache=True)
+def _polynomial_relation_moments(x, xerr, lowlims, uplims, xshifts, scatters, coeffs, nsample, rng, mean, std):
+    #monte-carlo mean and standard deviation of the relation, accumulated per star (Welford)
+    #without storing the (nsample, nstars) draws
+    nseg, ncoeffs= coeffs.shape
+    for i in range(x.size):
+        count= 0
+        mu= 0.
+        m2= 0.
+        for _ in range(nsample):
+            xs= x[i]+xerr[i]*rng.standard_normal()
+            total= 0.
+            nin= 0
+            for j in range(nseg):
+                if xs >= lowlims[j] and xs <= uplims[j]:
+                    #horner evaluation
+                    xj= xs-xshifts[j]
+                    val= coeffs[j, ncoeffs-1]
+                    for c in range(ncoeffs-2, -1, -1):
+                        val= val*xj+coeffs[j, c]
+                    total+= val+scatters[j]*rng.standard_normal()
+                    nin+= 1
+            if nin > 0:
+                val= total/nin
+                count+= 1
+                delta= val-mu
+                mu+= delta/count
+                m2+= delta*(val-mu)
+        if count > 0:
+            mean[i]= mu
+            std[i]= (m2/count)**0.5
+        else:
+            mean[i]= np.nan
+            std[i]= np.nan
 
+def apply_polynomial_relation(pol, x, xerr=0.0, nsample=100, rng=None, chunksize=None):
     """
-    x=np.array(x)
-    #handle cases where x is a float
-    size=0
-    if x.size==1:
-        x=np.array([x, x]).astype(float)
-        xerr=np.array([xerr, xerr]).astype(float)
-        size=-1
-    x=np.random.normal(x, xerr, (int(nsample), len(x)))
-    #if xerr is None
-    res= []
-    unc= []
-    #loop through each coefficient
-    for k in pol.keys():
-        #compute the shift to x values
-        xshift= pol[k]['xshift']
-        coeffs=pol[k]['coeffs']
-        scatter=pol[k]['yerr']
-        
-        #shit x
-        x_s=x-xshift
-        
-        #mask the low limit and high limit
-        lowlim= float(k.split('_')[0])-xshift
-        uplim= float(k.split('_')[-1])-xshift
-    
-        
-        #compute masked arrays
-        masked_x= np.ma.masked_outside(x_s, lowlim, uplim, copy=True)
-      
-        #compute polynomials
-        ans= np.nansum([coeffs[i]*(masked_x**i) for i in range(len(coeffs))], axis=0)
-        
-        #update the result inside bounds
-        masked_ans=np.ma.masked_array(ans, mask=masked_x.mask)
-        
-        #resample with uncertainties
-        vals=np.random.normal(masked_ans.filled(fill_value=np.nan), scatter )
-        
-    
-        
-        res.append(vals)
+    Monte-carlo evaluation of a piecewise polynomial relation with its scatter
+    Args:
+    ----
+        pol: piecewise polynomial relation ({'lo_hi': {'coeffs', 'xshift', 'yerr'}})
+        x: values (float or array)
+        xerr: optional, uncertainties in x (float or array)
+        nsample: optional, number of monte-carlo samples per value
+        rng: optional, seed or np.random.Generator (see get_rng)
+        chunksize: optional, number of values evaluated at a time, to bound memory for very large
+                   or memory-mapped inputs (int)
+    Returns:
+    -------
+        mean and standard deviation of the relation at x (floats or arrays, nans outside the relation)
+
+    Examples:
+    --------
+        > teff, teff_unc= apply_polynomial_relation(pol, np.array([20, 25, 30]), nsample=1000)
 
-    res=np.nanmean(res, axis=0)
-    if size ==-1:
-        return np.nanmedian(res.flatten()), np.nanstd(res.flatten())
-    if size !=-1:
-        return np.nanmean(res, axis=0), np.nanstd(res, axis=0)
+    """
+    scalar= np.ndim(x)==0
+    x= np.atleast_1d(x)
+    n= x.size
+    rng=get_rng(rng)
+    lowlims, uplims, xshifts, scatters, coeffs= compile_polynomial_relation(pol)
+    xerr= np.broadcast_to(np.asarray(xerr, dtype=float), x.shape).ravel()
+    mean= np.empty(n)
+    std= np.empty(n)
+    chunksize= max(n if chunksize is None else int(chunksize), 1)
+    for start in range(0, n, chunksize):
+        stop= min(start+chunksize, n)
+        _polynomial_relation_moments(np.ascontiguousarray(x.ravel()[start:stop], dtype=float), \
+                                     np.ascontiguousarray(xerr[start:stop]), lowlims, uplims, xshifts, scatters, coeffs, \
+                                     int(nsample), rng, mean[start:stop], std[start:stop])
+    if scalar:
+        return mean[0], std[0]
+    return mean.reshape(x.shape), std.reshape(x.shape)
+
+
+def compile_poly1d_relations(pol, keys):
+    """
+    Pack np.poly1d-style relations ({'fit', 'x0', 'range', 'scatter'}) for several keys into matrices,
+    built once per (relations, keys). Missing keys are kept as relations that are nan everywhere
+    Args:
+    ----
+        pol: dictionary of relations e.g. POLYNOMIALS['absmags_spt']['dwarfs']
+        keys: relations to compile e.g. filter names (list)
+    Returns:
+    -------
+        dictionary with keys, coeffs (nkeys, max number of coefficients, highest power first),
+        x0, lowlims, uplims and scatter (arrays of length nkeys)
 
+    Examples:
+    --------
+        > compiled= compile_poly1d_relations(POLYNOMIALS['absmags_spt']['dwarfs'], ['2MASS_J', '2MASS_H'])
+    """
+    keys= tuple(keys)
+
+    def pack():
+        import warnings
+        ncoeffs= max([len(pol[k]['fit']) for k in keys if k in pol]+[1])
+        coeffs= np.zeros((len(keys), ncoeffs))
+        x0= np.zeros(len(keys))
+        lowlims= np.full(len(keys), np.inf)
+        uplims= np.full(len(keys), -np.inf)
+        scatter= np.zeros(len(keys))
+        for idx, k in enumerate(keys):
+            if k not in pol:
+                warnings.warn("{} relation not available".format(k))
+                continue
+            fit= np.asarray(pol[k]['fit'], dtype=float)
+            coeffs[idx, ncoeffs-len(fit):]= fit
+            x0[idx]= pol[k]['x0']
+            lowlims[idx], uplims[idx]= pol[k]['range'][0], pol[k]['range'][-1]
+            scatter[idx]= pol[k]['scatter']
+        return {'keys': list(keys), 'coeffs': coeffs, 'x0': x0, 'lowlims': lowlims, 'uplims': uplims, 'scatter': scatter}
+
+    #only the requested relations are hashed
+    return _RELATION_CACHE.get(('poly1d', keys, content_key([pol.get(k) for k in keys])), pack)
+
+@numba.njit(parallel=True, cache=True)
+def _evaluate_poly1d_relations(x, coeffs, x0, lowlims, uplims, out):
+    #horner evaluation of every relation at every x, nans outside (lowlim, uplim]
+    nkeys, ncoeffs= coeffs.shape
+    for i in numba.prange(x.shape[0]):
+        for j in range(nkeys):
+            if x[i] > lowlims[j] and x[i] <= uplims[j]:
+                xs= x[i]-x0[j]
+                val= coeffs[j, 0]
+                for c in range(1, ncoeffs):
+                    val= val*xs+coeffs[j, c]
+                out[i, j]= val
+            else:
+                out[i, j]= np.nan
+    return out
+
+def evaluate_poly1d_relations(compiled, x, scatter=None, rng=None, out=None, dtype=np.float64):
+    """
+    Evaluate compiled relations (see compile_poly1d_relations) for all keys in a single pass
+    Args:
+    ----
+        compiled: output of compile_poly1d_relations
+        x: values e.g. spectral types or temperatures (array, size N)
+        scatter: optional, None (no scatter), 'relation' (scatter of each relation) or a float
+        rng: optional, seed or np.random.Generator (see get_rng)
+        out: optional, preallocated output (array, (N, nkeys))
+        dtype: optional, np.float64 or np.float32 when out is not given
+    Returns:
+    -------
+        out (array, (N, nkeys)), nans outside the range of each relation
 
-def inverse_polynomial_relation(pol, y, xgrid, nsample=1000, interpolation='griddata'):
+    Examples:
+    --------
+        > mags= evaluate_poly1d_relations(compiled, spt, scatter='relation', rng=0)
     """
-    1D- Random draw by using numpy search on a grid
+    x= np.ascontiguousarray(x, dtype=float).ravel()
+    nkeys= len(compiled['keys'])
+    if out is None:
+        out= np.empty((x.size, nkeys), dtype=dtype)
+    _evaluate_poly1d_relations(x, compiled['coeffs'], compiled['x0'], compiled['lowlims'], compiled['uplims'], out)
+    if scatter is not None:
+        sigma= compiled['scatter'] if isinstance(scatter, str) and scatter=='relation' else np.full(nkeys, float(scatter))
+        noise= get_rng(rng).standard_normal(out.shape, dtype=out.dtype)
+        noise*= sigma.astype(out.dtype)
+        out+= noise
+    return out
+
+
+def polynomial_mean_and_scatter(pol, x):
+    """
+    Noiseless mean and scatter of a piecewise polynomial relation, i.e. the limit of
+    apply_polynomial_relation for an infinite number of samples
     Args:
     ----
-        x_grid: grid of values ( array)
-        cdf:  corresponding values from the CDF
-        nsample: optional, number of samples
+        pol: piecewise polynomial relation ({'lo_hi': {'coeffs', 'xshift', 'yerr'}})
+        x: values (array)
     Returns:
     -------
-        random draws
+        mean, scatter (arrays, nans outside the range of the relation)
+    """
+    x= np.asarray(x, dtype=float)
+    lowlims, uplims, xshifts, scatters, coeffs= compile_polynomial_relation(pol)
+    means= np.full((len(lowlims), x.size), np.nan)
+    variances= np.full((len(lowlims), x.size), np.nan)
+    for idx in range(len(lowlims)):
+        inside= np.logical_and(x.ravel() >= lowlims[idx], x.ravel() <= uplims[idx])
+        means[idx, inside]= np.polynomial.polynomial.polyval(x.ravel()[inside]-xshifts[idx], coeffs[idx])
+        variances[idx, inside]= scatters[idx]**2
+    #overlapping segments are averaged
+    nseg= np.sum(~np.isnan(means), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean= np.nansum(means, axis=0)/nseg
+        scatter= np.nansum(variances, axis=0)**0.5/nseg
+    return mean.reshape(x.shape), scatter.reshape(x.shape)
+
+def inverse_polynomial_table(pol, xgrid):
+    """
+    Monotonic inverse table of a piecewise polynomial relation, built once per (relation, grid)
+    Args:
+    ----
+        pol: piecewise polynomial relation
+        xgrid: grid of x values (array)
+    Returns:
+    -------
+        y (increasing array), corresponding x values, scatter in y
 
     Examples:
     --------
-        > x = np.arange(0, 10)
-        > cdf = x**3/(x[-1]**3)
-        > res= random_draw(x, cdf)
+        > ytab, xtab, yunc = inverse_polynomial_table(pol, np.linspace(10, 43, 1000))
+    """
+    xgrid= np.asarray(xgrid, dtype=float)
+
+    def build():
+        ygrid, yunc= polynomial_mean_and_scatter(pol, xgrid)
+        good= ~np.isnan(ygrid)
+        y, x, u= ygrid[good], xgrid[good], yunc[good]
+        if len(y) > 1 and y[0] > y[-1]:
+            y, x, u= y[::-1], x[::-1], u[::-1]
+        #keep the strictly increasing part so that the relation can be inverted
+        keep= np.concatenate([[True], y[1:] > np.maximum.accumulate(y)[:-1]])
+        return y[keep], x[keep], u[keep]
+
+    return _RELATION_CACHE.get(('inverse', content_key(pol), content_key(xgrid)), build)
+
+def inverse_polynomial_relation(pol, y, xgrid, nsample=1000, interpolation='griddata', rng=None):
+    """
+    Invert a piecewise polynomial relation y(x) including its scatter
+    Args:
+    ----
+        pol: piecewise polynomial relation
+        y: values to invert (array)
+        xgrid: grid of x values over which the relation is inverted (array)
+        nsample: optional, number of monte-carlo samples for 'griddata' and 'spline'
+        interpolation: optional, 'table' (memoized monotonic table, y is scattered and interpolated),
+                       'griddata' or 'spline' (interpolation over nsample monte-carlo realizations)
+        rng: optional, seed or np.random.Generator (see get_rng)
+    Returns:
+    -------
+        x values (nans more than 3 sigma outside the relation for 'table')
+
+    Examples:
+    --------
+        > spt= inverse_polynomial_relation(pol, teff, np.linspace(10, 43, 1000), interpolation='table')
 
     """
-    ygrid, yunc= apply_polynomial_relation(pol, xgrid, xerr=0.0, nsample=nsample)
+    rng=get_rng(rng)
+    if interpolation=='table':
+        ytab, xtab, utab= inverse_polynomial_table(pol, xgrid)
+        y= np.asarray(y, dtype=float)
+        y_scattered= rng.normal(y, np.interp(y, ytab, utab))
+        #values within 3 sigma of the ends of the relation are kept (as with the monte-carlo realizations),
+        #their scattered values are clipped to the table instead of falling off its ends
+        inside= np.logical_and(y >= ytab[0]-3*utab[0], y <= ytab[-1]+3*utab[-1])
+        return np.where(inside, np.interp(y_scattered, ytab, xtab), np.nan)[()]
+
+    from scipy.interpolate import griddata, InterpolatedUnivariateSpline
+    ygrid, yunc= apply_polynomial_relation(pol, xgrid, xerr=0.0, nsample=nsample, rng=rng)
 
     #remove nans
     nans= np.logical_or(np.isnan(ygrid), np.isnan(yunc))
     
     #reshape
-    rand_y= np.random.normal(ygrid[~nans], yunc[~nans], size=(int(nsample), len(yunc[~nans]))).flatten()
-    rand_x= np.random.normal(xgrid[~nans], np.zeros_like(xgrid[~nans]), size=(int(nsample), len(yunc[~nans]))).flatten()
+    rand_y= rng.normal(ygrid[~nans], yunc[~nans], size=(int(nsample), len(yunc[~nans]))).flatten()
+    rand_x= np.broadcast_to(xgrid[~nans], (int(nsample), len(yunc[~nans]))).flatten()
     
     #f=interp1d(rand_y, rand_x, assume_sorted = False, fill_value = np.nan, bounds_error=False)
 
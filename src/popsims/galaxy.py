@@ -3,27 +3,20 @@
 #thick and halo populations 
 ##############################
 
-from .core_tools import random_draw, get_distance,  trapzl
-from .constants import Rsun, Zsun, galcen_frame
-from astropy.coordinates import SkyCoord
+from .core_tools import random_draw, get_distance,  trapzl, get_rng
+from .constants import Rsun, Zsun
 
 
 import numpy as np
 import numba
-import scipy
-import scipy.integrate as integrate
-from scipy.interpolate import interp1d
-import pandas as pd
-import astropy.coordinates as astro_coord
-import astropy.units as u
 import warnings
 import collections
-from tqdm import tqdm
 from abc import ABCMeta
 from abc import abstractproperty, abstractmethod
 from functools import reduce
 #import gala.coordinates as gc
 #import gala.dynamics as gd
+#scipy, pandas and astropy are slow to import, they are imported inside the functions that need them
 
 #@numba.jit(nopython=True)
 def exponential_density(r, z, H,L):
@@ -207,7 +200,34 @@ class GalacticComponent(object):
 
         return reduce(compose, fs)
         
-    def sample_distances(self, dmin, dmax, nsample, dsteps=200, l=None, b=None):
+    def distance_table(self, dmin, dmax, l, b, dsteps=200):
+        """
+        Cumulative distribution of distances d^2\rho(r, z) along one direction, on a logarithmic grid
+
+        Args:
+        ----
+            dmin: minium of the distance
+            dmax: maximum distance
+            l, b: galactic longitude and latitude (radians)
+            dsteps: (optional): number of grid points and of steps in trapezoidal integration (int)
+        Returns:
+        -------
+            distance grid, unnormalized cdf (arrays)
+
+        Examples:
+        --------
+            > d, cdf = Disk().distance_table(10, 1000, 0., np.pi/2)
+
+        """
+        if dmin==0: #avoid weird issues
+            dmin=0.1
+        d=np.logspace(np.log10(dmin), np.log10(dmax),dsteps)
+        #compute r and z
+        cdf=np.array([self.volume( l, b, d[0], dx, dsteps=dsteps) for dx in d])
+        cdf[0]=cdf[1] #avoid zero at the start of the array
+        return d, cdf
+
+    def sample_distances(self, dmin, dmax, nsample, dsteps=200, l=None, b=None, rng=None, table=None):
         """
         Draw distances from a likelihood d^2\rho(r, z) by inverse-sampling
 
@@ -219,6 +239,8 @@ class GalacticComponent(object):
             l, b: (optional), galactic latitudes (astropy quantities).
                  if set to None, will randomly pick directions
             dsteps: (optional): number of steps in trapezoidal integration (int)
+            rng: (optional), seed or np.random.Generator (see core_tools.get_rng)
+            table: (optional), precomputed (distance grid, cdf) from distance_table for this direction
         Returns:
         -------
             distances: array of distances (astropy quantity)
@@ -231,20 +253,16 @@ class GalacticComponent(object):
         #if l and b are none sample from random direction using sphere-point picking 
         if dmin==0: #avoid weird issues
             dmin=0.1
-        if l is None:
-            l= 2*np.pi*np.random.uniform(0, 1)
-            b= np.arccos(2*np.random.uniform(0, 1)-1)-np.pi/2
-
-        d=np.logspace(np.log10(dmin), np.log10(dmax),dsteps)
-        #compute r and z
-        cdf=np.array([self.volume( l, b, d[0], dx, dsteps=dsteps) for dx in d])
-        cdf[0]=cdf[1] #avoid zero at the start of the array
-        #interpolate over cdf to get a smoother function
-        f=interp1d(d, cdf)
-        #increase the resolution
+        rng= get_rng(rng)
+        if table is None:
+            if l is None:
+                l= 2*np.pi*rng.uniform(0, 1)
+                b= np.arccos(2*rng.uniform(0, 1)-1)-np.pi/2
+            table= self.distance_table(dmin, dmax, l, b, dsteps=dsteps)
+        #interpolate over cdf at a higher resolution to get a smoother function
         d=np.logspace(np.log10(dmin), np.log10(dmax),int(nsample))
-        cdfvals=f(d)
-        return random_draw(d, cdfvals/np.nanmax(cdfvals), int(nsample))
+        cdfvals=np.interp(d, *table)
+        return random_draw(d, cdfvals/np.nanmax(cdfvals), int(nsample), rng=rng)
 
     def volume(self, l, b, dmin, dmax, dsteps=1000):
         """
@@ -393,7 +411,7 @@ class Halo(GalacticComponent):
         return spheroid_density(r, z, self.q, self.n)
 
 
-def get_velocities(ra, dec, d, population='thin_disk', age=None):
+def get_velocities(ra, dec, d, population='thin_disk', age=None, rng=None):
     """
        Draw velocities from a Gaussians assuming a velocity dispersion
 
@@ -412,6 +430,8 @@ def get_velocities(ra, dec, d, population='thin_disk', age=None):
                 "thick_disk": Bensby et al. 2013
                 "halo": carollo et al. 2007
 
+            rng (optional): seed or np.random.Generator (see core_tools.get_rng)
+
         Returns:
         -------
            a dictionaries with galaxy kinematics (UVW, vr, vphi, vz) and sky motions
@@ -420,6 +440,10 @@ def get_velocities(ra, dec, d, population='thin_disk', age=None):
         --------
             > 
     """
+    import pandas as pd
+    import astropy.units as u
+    from astropy.coordinates import SkyCoord
+    rng= get_rng(rng)
     vels={}
     #CHECK THAT ALL RA, DEC, D, AGE ARE THE SAME SIZE
     #s= SkyCoord(ra=ra*u.degree, dec=dec*u.degree, distance=d*u.pc )
@@ -453,9 +477,9 @@ def get_velocities(ra, dec, d, population='thin_disk', age=None):
 
         voff = -1.*(sigma_v**2)/k
 
-        us=np.random.normal(loc=0, scale=sigma_u, size=len(age))
-        vs =np.random.normal(loc=voff, scale=sigma_v, size=len(age))
-        ws =np.random.normal(loc=0.0, scale=sigma_w, size=len(age))
+        us=rng.normal(loc=0, scale=sigma_u, size=len(age))
+        vs =rng.normal(loc=voff, scale=sigma_v, size=len(age))
+        ws =rng.normal(loc=0.0, scale=sigma_w, size=len(age))
 
         vels['U']=us
         vels['V']=vs
@@ -479,25 +503,25 @@ def get_velocities(ra, dec, d, population='thin_disk', age=None):
 
         #I'm also averaging over metallicities, future version should be different
         bool0=abs_z <=1000
-        us[bool0]= np.random.normal(loc=-2.5, scale=58, size=len(z[bool0]))
-        vs[bool0]= np.random.normal(loc=-31, scale=52.5, size=len(z[bool0]))
-        ws[bool0]= np.random.normal(loc=2, scale=38, size=len(z[bool0]))
+        us[bool0]= rng.normal(loc=-2.5, scale=58, size=len(z[bool0]))
+        vs[bool0]= rng.normal(loc=-31, scale=52.5, size=len(z[bool0]))
+        ws[bool0]= rng.normal(loc=2, scale=38, size=len(z[bool0]))
 
         bool1= np.logical_and(abs_z >=1000, abs_z <=2000)
-        us[bool1]= np.random.normal(loc=-10, scale=136, size=len(z[bool1]))
-        vs[bool1]= np.random.normal(loc=-181, scale=105, size=len(z[bool1]))
-        ws[bool1]= np.random.normal(loc=-4, scale=78, size=len(z[bool1]))
+        us[bool1]= rng.normal(loc=-10, scale=136, size=len(z[bool1]))
+        vs[bool1]= rng.normal(loc=-181, scale=105, size=len(z[bool1]))
+        ws[bool1]= rng.normal(loc=-4, scale=78, size=len(z[bool1]))
 
 
         bool2= np.logical_and(abs_z >=2000, abs_z <=3000)
-        us[bool2]= np.random.normal(loc=-29, scale=163, size=len(z[bool2]))
-        vs[bool2]= np.random.normal(loc=-209, scale=121, size=len(z[bool2]))
-        ws[bool2]= np.random.normal(loc=4, scale=95, size=len(z[bool2]))
+        us[bool2]= rng.normal(loc=-29, scale=163, size=len(z[bool2]))
+        vs[bool2]= rng.normal(loc=-209, scale=121, size=len(z[bool2]))
+        ws[bool2]= rng.normal(loc=4, scale=95, size=len(z[bool2]))
 
         bool3= abs_z >=3000
-        us[bool3]= np.random.normal(loc=-37, scale=152, size=len(z[bool3]))
-        vs[bool3]= np.random.normal(loc=-237, scale=136, size=len(z[bool3]))
-        ws[bool3]= np.random.normal(loc=2, scale=109, size=len(z[bool3]))
+        us[bool3]= rng.normal(loc=-37, scale=152, size=len(z[bool3]))
+        vs[bool3]= rng.normal(loc=-237, scale=136, size=len(z[bool3]))
+        ws[bool3]= rng.normal(loc=2, scale=109, size=len(z[bool3]))
 
         #vels={'U': us, 'V':vs,  'W':ws }
         vels['U']=us
@@ -516,9 +540,9 @@ def get_velocities(ra, dec, d, population='thin_disk', age=None):
         #use Bensby et al
         v_assym=46
         uvw_lsr=[0, 0, 0]
-        us=np.random.normal(loc=uvw_lsr[0], scale=67,size=len(age))
-        vs=np.random.normal(loc=uvw_lsr[1]-v_assym, scale=38,size=len(age))
-        ws=np.random.normal(loc=uvw_lsr[-1], scale=35,size=len(age))
+        us=rng.normal(loc=uvw_lsr[0], scale=67,size=len(age))
+        vs=rng.normal(loc=uvw_lsr[1]-v_assym, scale=38,size=len(age))
+        ws=rng.normal(loc=uvw_lsr[-1], scale=35,size=len(age))
         #vels={'U': us, 'V':vs,  'W':ws }
         vels['U']=us
         vels['V']=vs
@@ -565,7 +589,9 @@ def get_proper_motion_from_uvw(ra, dec, d, U, V, W):
     #dec in degree
     #d in parsec
     #UVW in km/s
-    s=SkyCoord(ra=ra*u.degree, dec=dec*u.degree, distance=d*u.pc).transform_to( astro_coord.Galactic)
+    import astropy.units as u
+    import astropy.coordinates as astro_coord
+    s=astro_coord.SkyCoord(ra=ra*u.degree, dec=dec*u.degree, distance=d*u.pc).transform_to( astro_coord.Galactic)
     
     
     #this is centered around the sun
@@ -599,6 +625,9 @@ def get_proper_motion_cylindrical(ra,dec, d, vr, vphi, vz):
         dict: Dictionary with keys 'RV', 'mu_alpha_cosdec', and 'mu_delta' corresponding to the calculated radial velocity in km/s and proper motion in right ascension and declination in mas/yr.
 
     """
+    import astropy.units as u
+    import astropy.coordinates as astro_coord
+    from .constants import galcen_frame
     c=astro_coord.CylindricalDifferential(d_rho=vr*u.km/u.s,\
                                       d_phi=(vphi*u.rad/u.s).to(u.deg/u.s),\
                                       d_z=vz*u.km/u.s)
@@ -638,6 +667,9 @@ def get_vrphiz_from_radec_distance(ra, dec, distance, pmra_cosdec, pmdec, rv):
         dict: Dictionary with keys 'Vr', 'Vphi', and 'Vz' corresponding to the calculated velocities in km/s.
 
     """
+    import astropy.units as u
+    import astropy.coordinates as astro_coord
+    from .constants import galcen_frame
     c= astro_coord.ICRS(ra=ra*u.degree,dec=dec*u.degree,
                   distance=distance*u.pc,
                   pm_ra_cosdec=pmra_cosdec*u.mas/u.yr,
@@ -665,6 +697,9 @@ def get_uvw_from_radec_distance(ra, dec, distance, pmra_cosdec, pmdec, rv):
     Returns:
         dict: Dictionary with keys 'U', 'V', and 'W' corresponding to the calculated velocities in km/s.
     """
+    import astropy.units as u
+    import astropy.coordinates as astro_coord
+    from .constants import galcen_frame
     c= astro_coord.ICRS(ra=ra*u.degree,dec=dec*u.degree,
                   distance=distance*u.pc,
                   pm_ra_cosdec=pmra_cosdec*u.mas/u.yr,
@@ -707,7 +742,7 @@ def avr_aumer(sigma, direction='vertical', verbose=False):
     return result
 
 
-def avr_yu(sigma, verbose=False, disk='thin', direction='vertical', height='above', nsample=1e4):
+def avr_yu(sigma, verbose=False, disk='thin', direction='vertical', height='above', nsample=1e4, rng=None):
     """
     Determine the age of a population based on its velocity dispersion.
 
@@ -725,6 +760,7 @@ def avr_yu(sigma, verbose=False, disk='thin', direction='vertical', height='abov
         direction: An optional string that specifies the direction of the velocity dispersion.
         height: An optional string that specifies whether the population is above or below a certain height.
         nsample: An optional integer that specifies the number of samples to use in the Monte Carlo simulation.
+        rng: An optional seed or np.random.Generator (see core_tools.get_rng).
 
     Returns:
         The age of the population, as a floating point value or a tuple of two floating point values
@@ -751,14 +787,15 @@ def avr_yu(sigma, verbose=False, disk='thin', direction='vertical', height='abov
         vals=np.array([beta_dict[disk][direction][0], beta_dict[disk][direction][1]])
         beta=[(vals[:,0]).mean(), (vals[:,1]**2).sum()**0.5]
     verboseprint("Assuming Yu & Liu 2018, {} disk {} velocities ".format(disk, direction))
+    rng= get_rng(rng)
     if np.isscalar(sigma):
-        betas=(np.random.normal(beta[0], beta[-1], int(nsample)))
+        betas=(rng.normal(beta[0], beta[-1], int(nsample)))
         #sigmas= sigma**(np.random.normal(beta[0], beta[-1], 10000))
         #sigmas=((sigma/sigma10)**(1/betas))*(10+tau1)-tau1
         sigmas= sigma**(betas)
         return np.nanmedian(sigmas), np.nanstd(sigmas)
     else:
-        betas=(np.random.normal(beta[0], beta[-1], (int(nsample), len(sigma))))
+        betas=(rng.normal(beta[0], beta[-1], (int(nsample), len(sigma))))
         #sigmas= sigma**(np.random.normal(beta[0], beta[-1], 10000))
         #sigmas=((sigma/sigma10)**(1/betas))*(10+tau1)-tau1
         sigmas= sigma**(betas)
@@ -790,7 +827,7 @@ def avr_sanders(sigma, verbose=False, direction='vertical'):
     verboseprint("Assuming Sanders et al. 2018 Power for  velocity {}".format(direction))
     return sigma**(beta)
 
-def avr_sharma(sigma, direction='vertical', z=None, met=None, verbose=False, nsample=1000):
+def avr_sharma(sigma, direction='vertical', z=None, met=None, verbose=False, nsample=1000, rng=None):
     """
     Determine the age of a population based on its velocity dispersion, metallicity, and position.
 
@@ -808,6 +845,7 @@ def avr_sharma(sigma, direction='vertical', z=None, met=None, verbose=False, nsa
         verbose: An optional boolean flag that can be used to enable verbose output.
         nsample: An optional integer that specifies the number of samples to use for Monte Carlo uncertainty
             propagation.
+        rng: An optional seed or np.random.Generator (see core_tools.get_rng).
 
     Returns:
         A tuple containing the median age and uncertainty of the population, as floating point values.
@@ -850,10 +888,11 @@ def avr_sharma(sigma, direction='vertical', z=None, met=None, verbose=False, nsa
     
     #case for arrays
     if sigma.size >1:
-        beta_norm= np.random.normal(*beta, (int(nsample), len(sigma)))
-        sigma10_norm= np.random.normal(*sigma10, (int(nsample), len(sigma)))
-        gamma_z_norm= np.random.normal(*gamma_z, (int(nsample), len(sigma)))
-        gamma_met_norm= np.random.normal(*gamma_met, (int(nsample), len(sigma)))
+        rng= get_rng(rng)
+        beta_norm= rng.normal(*beta, (int(nsample), len(sigma)))
+        sigma10_norm= rng.normal(*sigma10, (int(nsample), len(sigma)))
+        gamma_z_norm= rng.normal(*gamma_z, (int(nsample), len(sigma)))
+        gamma_met_norm= rng.normal(*gamma_met, (int(nsample), len(sigma)))
         
         #truncate based on limits
         bools=np.logical_and.reduce([
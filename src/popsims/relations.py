@@ -3,11 +3,10 @@
 #includes some useful relations, for full package, see splat
 ##############################
 
-from scipy.interpolate import interp1d
 import numpy as np
 #import splat.empirical as spe
 
-from .core_tools import apply_polynomial_relation, inverse_polynomial_relation
+from .core_tools import apply_polynomial_relation, inverse_polynomial_relation, get_rng
 
 
 PECAUT_TEFF_SPT_RELATIONS={'pecaut': {'bibcode': '2013ApJS..208....9P', 'url': 'http://www.pas.rochester.edu/~emamajek/EEM_dwarf_UBVIJHK_colors_Teff.txt', \
@@ -73,95 +72,193 @@ kirkpatrick2020LF={'bin_center': np.array([ 525,  675,  825,  975, 1125, 1275, 1
     'unc': np.array([0.7 , 0.37, 0.32, 0.3 , 0.25, 0.3 , 0.22, 0.2 , 0.2 , 0.17, 0.18])}
 
 
-def teff_to_spt_pecaut(teff):
+class TabulatedRelation(object):
+    """
+    A tabulated relation y(x) evaluated by linear interpolation over sorted arrays, nans outside the table
+
+    Attributes:
+    ----
+        x, y: sorted table (arrays)
+
+    Example:
+    -------
+        > f= TabulatedRelation(rel['spt'], rel['values'])
+        > teff= f(np.array([20., 25.]))
+    """
+    def __init__(self, x, y):
+        x= np.asarray(x, dtype=float)
+        y= np.asarray(y, dtype=float)
+        order= np.argsort(x, kind='stable')
+        self.x= np.ascontiguousarray(x[order])
+        self.y= np.ascontiguousarray(y[order])
+
+    def __call__(self, x):
+        return np.interp(np.asarray(x, dtype=float), self.x, self.y, left=np.nan, right=np.nan)
+
+    def inverse(self):
+        """
+        Inverse relation x(y), for monotonic tables
+        """
+        return TabulatedRelation(self.y, self.x)
+
+
+PECAUT_SPT_TO_TEFF= TabulatedRelation(PECAUT_TEFF_SPT_RELATIONS['pecaut']['spt'], PECAUT_TEFF_SPT_RELATIONS['pecaut']['values'])
+PECAUT_TEFF_TO_SPT= PECAUT_SPT_TO_TEFF.inverse()
+
+
+def teff_to_spt_pecaut(teff, rng=None):
     """Convert effective temperature to spectral type using Pecaot et al. (2013) relation.
     Args:
-        teff (float): Effective temperature.
+        teff (float or array): Effective temperature.
+        rng (optional): seed or np.random.Generator (see core_tools.get_rng)
 
     Returns:
-        float: Spectral type.
+        float or array: Spectral type.
 
     """
-    rel=PECAUT_TEFF_SPT_RELATIONS['pecaut']
-    teffsc=np.random.normal(teff, 108)
-    fx=interp1d(rel['values'], rel['spt'], assume_sorted = False, fill_value = np.nan, bounds_error=False)
-    return fx(teffsc)
+    teffsc=get_rng(rng).normal(teff, PECAUT_TEFF_SPT_RELATIONS['pecaut']['fitunc'])
+    return PECAUT_TEFF_TO_SPT(teffsc)
   
-def spt_to_teff_pecaut(spt):
+def spt_to_teff_pecaut(spt, rng=None):
     """
     Convert spectral type to effective temperature using Pecaot et al. (2013) relation.
 
-    Copy code
     Args:
-        spt (float): Spectral type.
+        spt (float or array): Spectral type.
+        rng (optional): seed or np.random.Generator (see core_tools.get_rng)
 
     Returns:
-        float: Effective temperature.
+        float or array: Effective temperature.
 
     """
-    rel=PECAUT_TEFF_SPT_RELATIONS['pecaut']
-    fx=interp1d(rel['spt'], rel['values'], assume_sorted = False, fill_value = np.nan,  bounds_error=False)
-    return np.random.normal(fx(spt), 108)
+    return get_rng(rng).normal(PECAUT_SPT_TO_TEFF(spt), PECAUT_TEFF_SPT_RELATIONS['pecaut']['fitunc'])
 
 
-def scale_to_local_lf(teffs):
+def local_lf_histograms(teffs):
     """
-    This function takes in an array of Teff values and scales it to the local luminosity function (LF) as determined by Kirkpatrick et al. (2020).
+    Number of objects in the Kirkpatrick et al. (2020) luminosity function Teff bins
 
-    Copy code
     Parameters
     ----------
-    teffs: array-like
-        Array of Teff values to be scaled to the local LF.
+    teffs: array-like or list of array-like
+        Teff values of one population, or a list with one array per population
 
     Returns
     -------
-    res: list
-        A list containing the median scale, standard deviation of the scale, and the sum of the predicted values multiplied by the median scale.
+    counts: array
+        (n_bins,) counts for one population, (n_models, n_bins) for a list of populations
     """
     binedges= np.append(kirkpatrick2020LF['bin_center']-75, kirkpatrick2020LF['bin_center'][-1]+75)
-    preds=np.histogram(teffs, bins=binedges, normed=False)[0]
-    
+    nbins= len(binedges)-1
+    batch= (isinstance(teffs, (list, tuple)) and len(teffs) > 0 and np.ndim(teffs[0]) > 0) or \
+           (isinstance(teffs, np.ndarray) and teffs.ndim==2)
+    if not batch:
+        return np.histogram(np.asarray(teffs, dtype=float), bins=binedges)[0]
+    #all populations in one pass: offset the bin index of each model and count once
+    sizes= np.array([len(t) for t in teffs])
+    values= np.concatenate([np.asarray(t, dtype=float).ravel() for t in teffs])
+    models= np.repeat(np.arange(len(teffs)), sizes)
+    bins= np.searchsorted(binedges, values, side='right')-1
+    #the last edge is included like in np.histogram
+    bins[values==binedges[-1]]= nbins-1
+    keep= np.logical_and(bins >= 0, bins < nbins)
+    counts= np.bincount(models[keep]*nbins+bins[keep], minlength=len(teffs)*nbins)
+    return counts.reshape(len(teffs), nbins)
+
+def scale_histograms_to_local_lf(preds, nsample=None, rng=None):
+    """
+    Weighted least-squares scale of model histograms to the local luminosity function of Kirkpatrick et al. (2020),
+    for many models at once
+
+    Parameters
+    ----------
+    preds: array-like
+        (n_bins,) or (n_models, n_bins) model counts in the luminosity function bins (see local_lf_histograms)
+    nsample: int, optional
+        None computes the scale and its uncertainty analytically, otherwise the number of Monte Carlo draws
+        of the observed luminosity function (median and standard deviation of the draws)
+    rng: optional
+        seed or np.random.Generator for the Monte Carlo (see core_tools.get_rng)
+
+    Returns
+    -------
+    scale, scale_unc, scale_times_model: arrays of length n_models (floats for 1-D input)
+    """
+    preds= np.asarray(preds, dtype=float)
+    single= preds.ndim==1
+    preds= np.atleast_2d(preds)
     obs=np.array(kirkpatrick2020LF['values'])
     unc=np.array(kirkpatrick2020LF['unc'])
-    
-    obs_monte_carlo= np.random.normal(obs, unc, (10000, len(obs)))
-    pred_monte= np.ones_like(obs_monte_carlo)*(preds)
-    unc_monte=  np.ones_like(obs_monte_carlo)*(unc)
 
-    scale=(np.nansum((obs_monte_carlo*pred_monte)/(unc_monte**2), axis=1)\
-           /np.nansum(((pred_monte**2)/(unc_monte**2)), axis=1))*(10**-3)
-    
-    
-    res=[np.nanmedian(scale), np.nanstd(scale), \
-                                     np.sum(preds*np.nanmedian(scale))]
+    weights= preds/unc**2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denominator= np.sum(preds*weights, axis=1)
+        if nsample is None:
+            #the scale is linear in the observations, its distribution is gaussian
+            scale= (weights @ obs)/denominator*(10**-3)
+            scale_unc= (10**-3)/denominator**0.5
+        else:
+            obs_monte_carlo= get_rng(rng).normal(obs, unc, (int(nsample), len(obs)))
+            scale= np.empty(len(preds))
+            scale_unc= np.empty(len(preds))
+            #bound the (nsample, n_models) temporary
+            step= max(1, int(2**22//max(int(nsample), 1)))
+            for start in range(0, len(preds), step):
+                draws= (obs_monte_carlo @ weights[start:start+step].T)/denominator[start:start+step]*(10**-3)
+                scale[start:start+step]= np.nanmedian(draws, axis=0)
+                scale_unc[start:start+step]= np.nanstd(draws, axis=0)
+    scale_times_model= np.sum(preds, axis=1)*scale
+    if single:
+        return scale[0], scale_unc[0], scale_times_model[0]
+    return scale, scale_unc, scale_times_model
+
+def scale_to_local_lf(teffs, rng=None, nsample=None):
+    """
+    This function takes in an array of Teff values and scales it to the local luminosity function (LF) as determined by Kirkpatrick et al. (2020).
 
-    return res
+    Parameters
+    ----------
+    teffs: array-like
+        Array of Teff values to be scaled to the local LF.
+    rng: optional
+        seed or np.random.Generator for the Monte Carlo over the observed LF (see core_tools.get_rng)
+    nsample: int, optional
+        None (default) computes the weighted least-squares scale and its uncertainty analytically,
+        otherwise the number of Monte Carlo draws of the observed LF
+
+    Returns
+    -------
+    res: list
+        A list containing the median scale, standard deviation of the scale, and the sum of the predicted values multiplied by the median scale.
+    """
+    preds= local_lf_histograms(teffs)
+    return list(scale_histograms_to_local_lf(preds, nsample=nsample, rng=rng))
 
-def  spt_to_teff_kirkpatrick(spt):
-    return apply_polynomial_relation(LITERATURE_POLYNOMIALS['kirkpatrick2021']['x=spt,y=teff'], spt)
+def  spt_to_teff_kirkpatrick(spt, rng=None):
+    return apply_polynomial_relation(LITERATURE_POLYNOMIALS['kirkpatrick2021']['x=spt,y=teff'], spt, rng=rng)
  
 
-def teff_to_spt_kirkpatrick(teff, nsample=1000):
+def teff_to_spt_kirkpatrick(teff, nsample=1000, rng=None):
     sptgrid=np.linspace(10, 43, 1000)
     return inverse_polynomial_relation(LITERATURE_POLYNOMIALS['kirkpatrick2021']['x=spt,y=teff'], teff, sptgrid, \
-        nsample=nsample, interpolation='griddata')
+        nsample=nsample, interpolation='table', rng=rng)
 
 
-def teff_to_mag_kirkpatrick(teff, nsample=1000):
+def teff_to_mag_kirkpatrick(teff, nsample=1000, rng=None):
     sptgrid=np.linspace(10, 43, 1000)
     return inverse_polynomial_relation(LITERATURE_POLYNOMIALS['kirkpatrick2021']['x=h_2mass,y=teff'], teff, sptgrid, \
-        nsample=nsample, interpolation='griddata')
+        nsample=nsample, interpolation='table', rng=rng)
 
     
-def teff_to_spt_subdwarf(teff):
+def teff_to_spt_subdwarf(teff, rng=None):
+    rng= get_rng(rng)
     values= np.empty_like(teff)
     mask=np.logical_or(teff <1600, teff>2700) #use dwarfs for higher teff 
-    values[mask]=teff_to_spt_pecaut(teff).flatten()[mask]
+    values[mask]=teff_to_spt_pecaut(teff, rng=rng).flatten()[mask]
     pol=LITERATURE_POLYNOMIALS['gonzales2018']['x=spt,y=teff']
     sptgrid=np.linspace(10, 43, 1000)
     values[~mask]=inverse_polynomial_relation(pol, teff, sptgrid, \
-        nsample=100, interpolation='griddata')[~mask]
+        nsample=100, interpolation='table', rng=rng)[~mask]
     return values
 
 def interpolated_local_lf():
@@ -170,9 +267,10 @@ def interpolated_local_lf():
     binedges= np.append(kirkpatrick2020LF['bin_center']-75, kirkpatrick2020LF['bin_center'][-1]+75)
     obs=np.array(kirkpatrick2020LF['values'])
     unc=np.array(kirkpatrick2020LF['unc'])
+    from scipy.interpolate import interp1d
     return interp1d( binedges, obs, assume_sorted = False, fill_value = np.nan, bounds_error=False)
 
-def polynomial_relation(x, xkey, ykey, ref, nsample=1000, xerr=0.0):
+def polynomial_relation(x, xkey, ykey, ref, nsample=1000, xerr=0.0, rng=None):
     """
     This function calculates the polynomial relation using the given input values.
 
@@ -183,14 +281,15 @@ def polynomial_relation(x, xkey, ykey, ref, nsample=1000, xerr=0.0):
     ref (str): The reference for the literature polynomial
     nsample (int): The number of samples for Monte Carlo simulation (default=1000)
     xerr (float): The error in the independent variable (default=0.0)
+    rng (optional): seed or np.random.Generator (see core_tools.get_rng)
 
     Returns:
     float or array: The polynomial relation value(s)
     """
     pol= LITERATURE_POLYNOMIALS[ref]['x={},y={}'.format(xkey, ykey)]
-    return apply_polynomial_relation(pol, x, xerr=0.0, nsample=nsample)
+    return apply_polynomial_relation(pol, x, xerr=0.0, nsample=nsample, rng=rng)
 
-def absolute_mag_from_spt(spt, mag='j', syst='mko', ref='kirkpatrick2021',  nsample=1000):
+def absolute_mag_from_spt(spt, mag='j', syst='mko', ref='kirkpatrick2021',  nsample=1000, rng=None):
     """Returns absolute magnitude from polynomial relation.
     Args:
         spt (float): Spectral type.
@@ -198,6 +297,7 @@ def absolute_mag_from_spt(spt, mag='j', syst='mko', ref='kirkpatrick2021',  nsam
         syst (str): Magnitude system to use (default 'mko').
         ref (str): Reference for polynomial relation (default 'kirkpatrick2021').
         nsample (int): Number of samples to use for Monte Carlo (default 1000).
+        rng (optional): seed or np.random.Generator (see core_tools.get_rng)
 
     Returns:
         float: Absolute magnitude.
@@ -205,4 +305,4 @@ def absolute_mag_from_spt(spt, mag='j', syst='mko', ref='kirkpatrick2021',  nsam
     """
     #retuns abs mag from polynomial relation
     pol= LITERATURE_POLYNOMIALS[ref]['x=spt,y={}_{}'.format(mag, syst)]   
-    return apply_polynomial_relation(pol, spt, xerr=0.0, nsample=nsample)
\ No newline at end of file
+    return apply_polynomial_relation(pol, spt, xerr=0.0, nsample=nsample, rng=rng)
\ No newline at end of file
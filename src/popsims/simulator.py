@@ -1,15 +1,44 @@
 ##purpose: simulate a brown dwarf population
 ###
 #imports
+import collections
+import copy
+import functools
+import itertools
+import inspect
+import os
+import warnings
+import numpy as np
+import pandas as pd
 from .galaxy import * 
 from .core import *
 from .core_tools import *
-from .relations import teff_to_spt_subdwarf
-import seaborn as sns
+from .relations import scale_to_local_lf, teff_to_spt_kirkpatrick, spt_to_teff_kirkpatrick, teff_to_spt_pecaut, \
+spt_to_teff_pecaut, teff_to_spt_subdwarf
+
+#names re-exported by the popsims package
+__all__=['Population', 'make_systems', 'pop_mags', 'compute_vols_and_numbers']
 #from tqdm import tqdm
 #tqdm.pandas()
 
 
+def _pipeline_step(method):
+    #record the arguments of the add_* methods, so that apply_selection can replay them on extra blocks
+    signature= inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments= signature.bind(self, *args, **kwargs).arguments
+        arguments.pop('self')
+        for name, param in signature.parameters.items():
+            if param.kind==param.VAR_KEYWORD:
+                arguments.update(arguments.pop(name, {}))
+        res= method(self, *args, **kwargs)
+        self._steps.append((method.__name__, dict(arguments)))
+        return res
+    return wrapper
+
+
 class Population(object):
     """
     Class for a poulation
@@ -45,125 +74,168 @@ class Population(object):
         self.massrange= kwargs.get('mass_range', [0.01, 1.])
         self.nsample= kwargs.get('nsample',1e4)
         self.evol_model=kwargs.get('evol_model', None) #evolutionary model object
+        self.imf=kwargs.get('imf', None) #mass function object e.g. LogNormalIMF(), overrides imf_power
+        self.sfh=kwargs.get('sfh', None) #age distribution object e.g. ExponentialSFH(), overrides age_range
+        self.seed=kwargs.get('seed', None) #integer, np.random.SeedSequence or np.random.Generator, for reproducible draws
+        self.rng=get_rng(self.seed)
+        #simulated columns, also available as attributes e.g. p.mass
+        self.table=PopulationTable(float_dtype=kwargs.get('float_dtype', np.float32))
+        #distance cdfs per galactic model and direction, shared with the blocks of iter_simulate
+        self._distance_tables={}
+        #arguments of simulate and the steps applied after it, replayed by apply_selection
+        self._simulate_kwargs=None
+        self._steps=[]
+        self.nsimulated=0
+
+    def __getattr__(self, name):
+        #only called when normal attribute lookup fails
+        table= self.__dict__.get('table')
+        if table is not None and name in table:
+            return table[name]
+        raise AttributeError("{!r} object has no attribute {!r}".format(type(self).__name__, name))
+
+    def __setattr__(self, name, value):
+        #arrays with one value per system are columns e.g. p.foo= p.mass*2, so that they show up in
+        #to_dataframe and in selections
+        table= self.__dict__.get('table')
+        if table is not None and name not in self.__dict__ and (name in table or (len(table) > 0 and \
+           isinstance(value, (np.ndarray, pd.Series)) and np.ndim(value)==1 and len(value)==len(table))):
+            table[name]= value
+        else:
+            super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        table= self.__dict__.get('table')
+        if table is not None and name not in self.__dict__ and name in table:
+            del table[name]
+        else:
+            super().__delattr__(name)
 
-    def _sample_ages(self):
-        return np.random.uniform(*self.agerange, int(self.nsample))
+    def __dir__(self):
+        table= self.__dict__.get('table')
+        return sorted(set(super().__dir__()) | set([] if table is None else table.keys()))
+
+    def _sample_ages(self, nsample=None):
+        nsample= int(self.nsample if nsample is None else nsample)
+        if self.sfh is not None:
+            return self.sfh.sample(nsample, rng=self.rng)
+        return self.rng.uniform(*self.agerange, nsample)
     
-    def _sample_masses(self):
+    def _sample_masses(self, nsample=None):
+        nsample= int(self.nsample if nsample is None else nsample)
+        if self.imf is not None:
+            return self.imf.sample(nsample, rng=self.rng)
         if self.imfpower=='kroupa':
-            m0, m1, m2 = (
-                sample_from_powerlaw(-0.3, xmin=0.03, xmax=0.08, nsample=int(self.nsample)),
-                sample_from_powerlaw(-1.3, xmin=0.08, xmax=0.5, nsample=int(self.nsample)),
-                sample_from_powerlaw(-2.3, xmin=0.5, xmax=100, nsample=int(self.nsample))
-            )
-            m = np.concatenate([m0, m1, m2]).flatten()
-            mask = np.logical_and(m > self.massrange[0], m < self.massrange[1])
-            masses = np.random.choice(m[mask], int(self.nsample))
-            return masses
+            #continuous broken power law (see BrokenPowerLawIMF.kroupa), not the equal-weight mix of segments used before
+            return sample_from_broken_powerlaw([-0.3, -1.3, -2.3], [0.03, 0.08, 0.5, 100], \
+                                               xmin=self.massrange[0], xmax=self.massrange[1], \
+                                               nsample=nsample, rng=self.rng)
         else:
             return sample_from_powerlaw(
                 self.imfpower,
                 xmin=self.massrange[0],
                 xmax=self.massrange[1],
-                nsample=int(self.nsample),
+                nsample=nsample,
+                rng=self.rng,
             )
 
-    def _interpolate_evolutionary_model(self, mass, age, additional_columns=[]):
-        #columns that I need are mass, age, teff, luminosity,
-       
-        #reinitialize evolmodel object if necessary
-        required_columns=np.concatenate([['mass', 'age', 'temperature', 'luminosity'], additional_columns])
+    def _evolve(self, masses, ages, additional_columns=[]):
+        #interpolate several sets of stars in one batch, returns one dictionary of views per set
+        sizes= [len(m) for m in masses]
         if self.evol_model is None and self.evolmodel_name is None:
             raise ValueError('Please specify evolutionay model grid')
-        
         if  self.evol_model is None:
-            df=pd.DataFrame(EVOL_MODELS[self.evolmodel_name])
-            self.evol_model=EvolutionaryModel(df)
-        
-        #first remove nans
-        lmass=np.log10(mass)
-        lage= np.log10(age)
+            self.evol_model=EvolutionaryModel.from_name(self.evolmodel_name)
 
+        lmass=np.log10(np.concatenate(masses).astype(float))
+        lage=np.log10(np.concatenate(ages).astype(float))
+        required_columns=['mass', 'age', 'temperature', 'luminosity']+list(additional_columns)
         res=self.evol_model.interpolate('mass','age', lmass, lage, \
                                         logscale=['mass', 'age', 'temperature'], \
-                                            interp_columns=required_columns)
-        #return evolutionary_model_interpolator(mass, age, self.evolmodel)
+                                        interp_columns=required_columns, as_dict=True)
         res['mass']=10**lmass
         res['age']=10**lage
-        res['temperature']=10**res.temperature.values
-        #res['luminosity']= 10**res.luminosity.values
-        return res
-    
+        res['temperature']=10**res['temperature']
+        res['spt']=self._spectral_types(res['temperature'])
+
+        bounds=np.concatenate([[0], np.cumsum(sizes)])
+        return [{k: v[lo:hi] for k, v in res.items()} for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    def _spectral_types(self, teff):
+        #kirkpatrick relation, pecaut above 2000K
+        teff= np.asarray(teff, dtype=float)
+        spt= teff_to_spt_kirkpatrick(teff, rng=self.rng)
+        high_teff_mask = teff > 2000
+        spt[high_teff_mask] = teff_to_spt_pecaut(teff[high_teff_mask], rng=self.rng)
+        return spt
+
     def scale_to_local_lf(self):
-        scale, scale_unc, scale_times_model = scale_to_local_lf(self.temperature)
+        scale, scale_unc, scale_times_model = scale_to_local_lf(self.temperature, rng=self.rng)
         self.scale= scale
         self.scale_unc= scale_unc
         self.scale_times_model= scale_times_model
 
-    def simulate(self, additional_columns=[]):
+    def simulate(self, additional_columns=[], mode='exact', n_jobs=1, block_size=1e4):
         """
-        Class for a poulation
+        Draw masses and ages, interpolate the evolutionary models and make single and binary systems
 
-        Attributes:
+        Args:
         ----
-            x_grid: grid of values ( array)
-            cdf:  corresponding values from the CDF
-            nsample: optional, number of samples
-
-        Properties:
+            additional_columns: optional, extra columns of the evolutionary models to interpolate (list)
+            mode: optional, 'exact' decides whether each system is a binary from binary_fraction up front
+                  and only evolves the stars that end up in the population (nsample systems),
+                  'resample' evolves nsample singles and nsample binaries and resamples them
+            n_jobs: optional, number of worker processes (int, -1 for all cores, at most the number of cores). The population is drawn
+                    in blocks of block_size systems with one child stream of seed each (as in iter_simulate),
+                    the result only depends on seed, nsample and block_size, not on n_jobs.
+                    Workers are spawned, so scripts need an if __name__ == '__main__' guard
+            block_size: optional, number of systems per block (int)
+        Returns:
         -------
-            random draws
-
-        Methods:
-        --------
+            None, the columns (mass, age, temperature, spt, is_binary...) are set as attributes
 
         Example:
         -------
-            > x = np.arange(0, 10)
-            > cdf = x**3/(x[-1]**3)
-            > res= random_draw(x, cdf)
-
+            > p= Population(evolmodel='baraffe2003', imf_power=-0.6, binary_fraction=0.2, nsample=1e4, seed=1)
+            > p.simulate()
+            > p.simulate(n_jobs=8)
         """
+        if mode not in ('exact', 'resample'):
+            raise ValueError("mode must be 'exact' or 'resample' not {}".format(mode))
+        self._simulate_kwargs= {'additional_columns': additional_columns, 'mode': mode}
+        self._steps= []
+        self.nsimulated= int(self.nsample)
+        self._simulate_blocks(additional_columns=additional_columns, mode=mode, n_jobs=n_jobs, block_size=block_size)
+
+    def _simulate_stream(self, additional_columns=[], mode='exact'):
+        #simulate nsample systems with the population's own random stream
+        nsample= int(self.nsample)
+        if mode=='exact':
+            nbinaries= self.rng.binomial(nsample, self.binaryfraction)
+            nsingles= nsample-nbinaries
+        else:
+            nbinaries= nsingles= nsample
+
         #single stars
-        m_singles=self._sample_masses()
-        ages_singles= self._sample_ages()
+        m_singles=self._sample_masses(nsingles)
+        ages_singles= self._sample_ages(nsingles)
         #binaries
-        qs=sample_from_powerlaw(self.binaryq, xmin= 1e-10, xmax=1., nsample=self.nsample)
-        m_prims = self._sample_masses()
+        qs=sample_from_powerlaw(self.binaryq, xmin= 1e-10, xmax=1., nsample=nbinaries, rng=self.rng)
+        m_prims = self._sample_masses(nbinaries)
         m_sec=m_prims*qs
-        ages_bin=self._sample_ages()
-
-        #interpolate evolurionary models
-        single_evol=self._interpolate_evolutionary_model(m_singles, ages_singles, additional_columns=additional_columns)
-        primary_evol=self._interpolate_evolutionary_model(m_prims,ages_bin, additional_columns=additional_columns)
-        secondary_evol=self._interpolate_evolutionary_model(m_sec,ages_bin, additional_columns=additional_columns)
-
+        ages_bin=self._sample_ages(nbinaries)
 
-        # Vectorize the following operations for better performance
-        teffs_singl, teffs_primar, teffs_second = (
-            single_evol["temperature"], #.value,
-            primary_evol["temperature"], #.value,
-            secondary_evol["temperature"], #.value,
-        )
-        
-        spts_singl, spt_primar, spt_second = (
-            teff_to_spt_kirkpatrick(teffs_singl),
-            teff_to_spt_kirkpatrick(teffs_primar),
-            teff_to_spt_kirkpatrick(teffs_second),
-        )
-        #use pecaut 
-        high_teff_mask = teffs_singl > 2000
-        spts_singl[high_teff_mask] = teff_to_spt_pecaut(teffs_singl[high_teff_mask])
-        spt_primar[high_teff_mask] = teff_to_spt_pecaut(teffs_primar[high_teff_mask])
-        spt_second[high_teff_mask] = teff_to_spt_pecaut(teffs_second[high_teff_mask])
+        #interpolate evolurionary models and compute spectral types for all stars at once
+        single_evol, primary_evol, secondary_evol= self._evolve([m_singles, m_prims, m_sec], \
+                                                                [ages_singles, ages_bin, ages_bin], \
+                                                                additional_columns=additional_columns)
+        spts_singl= single_evol.pop('spt')
+        spt_primar= primary_evol.pop('spt')
+        spt_second= secondary_evol.pop('spt')
 
         #compute combined binary spectral types
         xy=np.vstack([np.round(np.array(spt_primar), decimals=0), np.round(np.array(spt_second), decimals=0)]).T
-        spt_binr=np.array(get_system_type(xy[:,0], xy[:,1])).astype(float)
-        #Remember to assign <15 or >39 primary to primary and 
-        out_range=np.logical_or(xy[:,0] < 15, xy[:,0] > 39)
-        #print (spt_binr[out_range])
-        spt_binr[out_range]=xy[:,0][out_range]
+        spt_binr=get_system_type(xy[:,0], xy[:,1])
 
 
         values={ 'sing_evol': single_evol, 'sing_spt':spts_singl,
@@ -173,38 +245,44 @@ class Population(object):
 
         #make systems
         # these dict values should be properties of the population object --> can be bad for mem, avoid duplicating data
-        vals= make_systems(values, self.binaryfraction).sample(n=int(self.nsample)).to_dict(orient='list')
-        #add these values as attributes of the object
-        for k, v in vals.items():
-            setattr(self, k, v)
-
-        assert(len(self.temperature) == len(vals['temperature']))
-        #return values
+        systems= make_systems(values, self.binaryfraction, rng=self.rng, mode=mode)
+        if mode=='resample':
+            systems= systems.sample(n=nsample, random_state=self.rng)
+        #store the columns in the table, they are then available as attributes
+        self.table.clear()
+        for k in systems.columns:
+            self.table[k]= systems[k].to_numpy()
+
+        assert(len(self.temperature) == nsample)
     
-    def add_distances(self, gmodel, l, b, dmin, dmax, dsteps=1000):
+    @_pipeline_step
+    def add_distances(self, gmodel, l, b, dmin, dmax, dsteps=1000, maglimits=None):
         """
-        Class for a poulation
+        Draw distances from the density of a galactic model along one or several directions
 
-        Attributes:
+        Args:
         ----
-            x_grid: grid of values ( array)
-            cdf:  corresponding values from the CDF
-            nsample: optional, number of samples
-
-        Properties:
+            gmodel: galactic model (GalacticComponent)
+            l, b: galactic longitudes and latitudes of the directions (floats or arrays, radians)
+            dmin, dmax: distance range (floats, pc)
+            dsteps: optional, number of points in the distance cdf of each direction (int)
+            maglimits: optional, survey limits {filter: (bright, faint)} on the absolute magnitudes 'abs_'+filter
+                       from add_magnitudes. Each distance is then drawn within the range where the system passes
+                       all limits, and the probability of that range is stored in a 'weight' column, so that
+                       weighted counts equal the counts of a full simulation. Systems outside the limits at
+                       every distance get a nan distance and a zero weight
+        Returns:
         -------
-            random draws
-
-        Methods:
-        --------
+            None, sets distance (and weight and the apparent magnitudes of the maglimits filters)
 
         Example:
         -------
-            > x = np.arange(0, 10)
-            > cdf = x**3/(x[-1]**3)
-            > res= random_draw(x, cdf)
-
+            > p.add_magnitudes(['VISTA_J', 'VISTA_H'])
+            > p.add_distances(Disk(), l, b, 0.1, 2000, maglimits={'VISTA_J': (10, 20), 'VISTA_H': (10, 19.5)})
+            > counts= np.histogram(p.spt, bins, weights=p.weight)[0]
         """
+        if maglimits is not None:
+            return self._add_magnitude_limited_distances(gmodel, l, b, dmin, dmax, dsteps, maglimits)
         #gmodel = galactic component o
         #pick distances from 0.1pc to 10kpc at l=45 deg and b=0
         #case where l and b are floats
@@ -218,15 +296,61 @@ class Population(object):
                     dmin,
                     dmax,
                     int(1.5 * self.nsample / len(l)),
-                    l=l[idx],
-                    b=b[idx],
                     dsteps=dsteps,
+                    rng=self.rng,
+                    table=self._distance_table(gmodel, l[idx], b[idx], dmin, dmax, dsteps),
                 )
                 for idx in range(len(l))
             ]
         )
-        self.distance=np.random.choice(dists, len(self.temperature))
+        self.table['distance']=self.rng.choice(dists, len(self.temperature))
 
+    def _add_magnitude_limited_distances(self, gmodel, l, b, dmin, dmax, dsteps, maglimits):
+        #importance sampling: d is drawn from the cumulative volume V(d) restricted to [dlo, dhi]
+        #with weight (V(dhi)-V(dlo))/(V(dmax)-V(dmin))
+        l=np.array([l]).flatten()
+        b=np.array([b]).flatten()
+        assert len(l)== len(b)
+        filters= list(maglimits.keys())
+        missing= [f for f in filters if 'abs_'+f not in self.table]
+        if missing:
+            raise ValueError('add the absolute magnitudes {} with add_magnitudes first'.format(missing))
+        absmags= np.vstack([np.asarray(self.table['abs_'+f], dtype=float) for f in filters])
+        limits= np.array([np.broadcast_to(np.asarray(maglimits[f], dtype=float), (2,)) if np.ndim(maglimits[f]) else
+                          [-np.inf, maglimits[f]] for f in filters])
+        with np.errstate(invalid='ignore', over='ignore'):
+            dlo= np.max(10.**((limits[:, [0]]-absmags)/5. + 1.), axis=0)
+            dhi= np.min(10.**((limits[:, [1]]-absmags)/5. + 1.), axis=0)
+            dlo= np.clip(dlo, dmin, dmax)
+            dhi= np.clip(dhi, dmin, dmax)
+            valid= dhi > dlo
+
+        #directions are picked with equal probabilities, as in add_distances
+        direction= self.rng.integers(len(l), size=len(dlo))
+        u= self.rng.random(len(dlo))
+        distance= np.full(len(dlo), np.nan)
+        weight= np.zeros(len(dlo))
+        for idx in range(len(l)):
+            sel= np.logical_and(valid, direction==idx)
+            d, vol= self._distance_table(gmodel, l[idx], b[idx], dmin, dmax, dsteps)
+            vlo= np.interp(dlo[sel], d, vol)
+            vhi= np.interp(dhi[sel], d, vol)
+            weight[sel]= (vhi-vlo)/(vol[-1]-vol[0])
+            distance[sel]= np.interp(vlo+u[sel]*(vhi-vlo), vol, d)
+        self.table['distance']= distance
+        self.table['weight']= weight
+        distance_modulus= 5*np.log10(distance/10.0)
+        for f, absmag in zip(filters, absmags):
+            self.table[f]= absmag+distance_modulus
+
+    def _distance_table(self, gmodel, l, b, dmin, dmax, dsteps):
+        #keyed by id, the model is kept in the value so that its id is not reused
+        key=(id(gmodel), float(l), float(b), float(dmin), float(dmax), int(dsteps))
+        if key not in self._distance_tables:
+            self._distance_tables[key]=(gmodel, gmodel.distance_table(dmin, dmax, l, b, dsteps=dsteps))
+        return self._distance_tables[key][1]
+
+    @_pipeline_step
     def add_magnitudes(self, filters, get_from='spt', **kwargs):
         """
         Class for a poulation
@@ -251,24 +375,59 @@ class Population(object):
             > res= random_draw(x, cdf)
 
         """
-        if get_from=='spt':
-            mags=pop_mags(np.array(self.spt), keys=filters, get_from='spt', **kwargs)
-        
-        if get_from=='teff':
-            mags=pop_mags(np.array(self.temperature), keys=filters,  get_from='teff', **kwargs)
+        x= {'spt': self.spt, 'teff': self.temperature}[get_from]
+        kwargs.setdefault('dtype', self.table.float_dtype)
+        absmags=pop_mags(np.asarray(x), keys=filters, get_from=get_from, rng=self.rng, as_array=True, **kwargs)
 
-        if  self.distance is not None:
-            for f in filters: mags[f] = mags['abs_{}'.format(f)].values+5*np.log10(self.distance/10.0)
-
-        vals=mags.to_dict(orient='list')
+        distance= getattr(self, 'distance', None)
+        distance_modulus= None if distance is None else 5*np.log10(np.asarray(distance, dtype=float)/10.0)
         #add these values as attributes of the object
-        for k, v in vals.items():
-            setattr(self, k, v)
+        for idx, f in enumerate(filters):
+            self.table['abs_'+f]= absmags[:, idx]
+            if distance_modulus is not None:
+                self.table[f]= absmags[:, idx]+distance_modulus
             
-    def to_dataframe(self, columns):
-        data = {col: self.__dict__[col] for col in columns}
-        df = pd.DataFrame(data)
-        return df
+    @_pipeline_step
+    def add_colors(self, pairs, get_from='spt', object_type=None, scatter=None, dtype=np.float64):
+        """
+        Add colors from the colors_spt or colors_teff relations, all pairs in a single pass
+
+        Args:
+        ----
+            pairs: colors as (filter1, filter2) tuples or 'filter1andfilter2' strings (list)
+            get_from: optional, 'spt' or 'teff'
+            object_type: optional, 'dwarfs' or 'subdwarfs', defaults to the metallicity of the population
+            scatter: optional, None, 'relation' (scatter of each relation) or a float in mag
+            dtype: optional, np.float64 or np.float32
+        Returns:
+        -------
+            None, each color is set as an attribute named 'filter1-filter2' (nans outside the relations)
+
+        Example:
+        -------
+            > p.add_colors([('SDSS_R', 'SDSS_I'), 'LSST_GandPANSTARRS_G'])
+            > getattr(p, 'SDSS_R-SDSS_I')
+        """
+        from .abs_mag_relations import POLYNOMIALS
+        relations= POLYNOMIALS['colors_{}'.format(get_from)]
+        if object_type is None:
+            object_type= self.metallicity if self.metallicity in relations else 'dwarfs'
+        pol= relations[object_type]
+        pairs= [tuple(p.split('and')) if isinstance(p, str) else tuple(p) for p in pairs]
+        #relations are stored once per pair, in either order
+        keys= ['{}and{}'.format(b, a) if '{}and{}'.format(a, b) not in pol and '{}and{}'.format(b, a) in pol \
+               else '{}and{}'.format(a, b) for a, b in pairs]
+        sign= np.array([-1. if k != '{}and{}'.format(a, b) else 1. for k, (a, b) in zip(keys, pairs)], dtype=dtype)
+        x= {'spt': self.spt, 'teff': self.temperature}[get_from]
+        colors= evaluate_poly1d_relations(compile_poly1d_relations(pol, keys), np.asarray(x), scatter=scatter, \
+                                          rng=self.rng, dtype=dtype)
+        colors*= sign
+        for idx, (a, b) in enumerate(pairs):
+            self.table['{}-{}'.format(a, b)]= colors[:, idx]
+
+    def to_dataframe(self, columns=None):
+        #no copy of the columns
+        return self.table.to_dataframe(columns)
 
     def visualize(self, keys=['mass', 'age', 'spt'], ms=0.1):
         """
@@ -294,18 +453,125 @@ class Population(object):
             > res= random_draw(x, cdf)
 
         """
-        df=pd.DataFrame.from_records([self.__dict__[x] for x in  keys]).T
-        df.columns=keys
+        df=self.to_dataframe(keys)
 
         import matplotlib.pyplot as plt
+        import seaborn as sns
         g = sns.PairGrid(df[keys] , diag_sharey=False, corner=True)
         g.map_diag(plt.hist, log=True, bins=32)
         g.map_offdiag(sns.scatterplot, size=ms, color='k', alpha=0.1)
 
+    def iter_simulate(self, chunk_size=1e5, steps=[], additional_columns=[], mode='exact', block_size=1e4):
+        """
+        Simulate the population in chunks, so that memory is bounded by the chunk size and not by nsample
+
+        The population is drawn in blocks of block_size systems, block i uses the i-th child stream of seed
+        (see core_tools.spawn_rngs), the blocks are then cut into chunks. The concatenated chunks do not
+        depend on chunk_size, only on seed, nsample and block_size
+
+        Args:
+        ----
+            chunk_size: number of systems per chunk (int)
+            steps: optional, list of (method name, keyword arguments) applied to every block after simulate
+                   e.g. [('add_distances', {...}), ('add_magnitudes', {'filters': [...]})], with
+                   ('apply_selection', {'selection': ...}) the chunks only hold the selected systems
+            additional_columns: optional, extra columns of the evolutionary models to interpolate (list)
+            mode: optional, see simulate
+            block_size: optional, number of systems drawn with one random stream (int)
+        Returns:
+        -------
+            generator of pandas.DataFrame, indexed by the position of the systems in the full population
+
+        Example:
+        -------
+            > p= Population(evolmodel='baraffe2003', nsample=1e8, seed=1)
+            > for df in p.iter_simulate(chunk_size=1e6, steps=[('add_magnitudes', {'filters': ['VISTA_J']})]):
+            >      counts += np.histogram(df.VISTA_J, bins)[0]
+        """
+        chunk_size= int(chunk_size)
+        assert chunk_size > 0, 'chunk_size must be positive'
+        pending, npending, start= [], 0, 0
+        blocks= self._iter_blocks(block_size, additional_columns=additional_columns, mode=mode, steps=steps)
+        for table, last in blocks:
+            pending.append(table.to_dataframe())
+            npending += len(pending[-1])
+            while npending >= chunk_size or (npending > 0 and last):
+                df= pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+                chunk= df.iloc[:chunk_size]
+                chunk.index= pd.RangeIndex(start, start+len(chunk))
+                yield chunk
+                start += len(chunk)
+                pending= [df.iloc[chunk_size:]] if len(df) > chunk_size else []
+                npending= len(df)-len(chunk)
+
+    def _simulate_blocks(self, additional_columns=[], mode='exact', n_jobs=1, block_size=1e4):
+        #simulate the blocks of iter_simulate, possibly in worker processes, and copy them once into the table
+        self.table.clear()
+        blocks= (table for table, _ in self._iter_blocks(block_size, additional_columns=additional_columns, mode=mode,
+                                                         n_jobs=n_jobs))
+        self.table= PopulationTable.concatenate(blocks, int(self.nsample))
+
+    def _iter_blocks(self, block_size, additional_columns=[], mode='exact', steps=[], n_jobs=1):
+        #yields (table, is last block) for blocks of block_size systems, block i uses the i-th child stream
+        block_size= int(block_size)
+        nsample= int(self.nsample)
+        assert block_size > 0, 'block_size must be positive'
+        #draw the entropy once, so that every block uses a child of the same sequence
+        seq= get_seed_sequence(self.rng if self.seed is None else self.seed)
+        if self.evol_model is None and self.evolmodel_name is not None:
+            self.evol_model=EvolutionaryModel.from_name(self.evolmodel_name)
+        #lazy, the streams of the blocks are only spawned when the blocks are simulated
+        nblocks= -(-nsample//block_size)
+        tasks= ((spawn_rngs(seq, 1, start=idx)[0], min(block_size, nsample-lo), additional_columns, mode, steps)
+                for idx, lo in enumerate(range(0, nsample, block_size)))
+        #more workers than cores only adds start-up costs, the result does not depend on the number of workers
+        ncores= len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        n_jobs= ncores if n_jobs==-1 else min(int(n_jobs), ncores)
+        if n_jobs <= 1 or nblocks <= 1:
+            for idx, task in enumerate(tasks):
+                yield self._simulate_block(*task), idx==nblocks-1
+            return
+        #the population (evolutionary model, distance tables) is pickled once per worker, not per block
+        #workers are spawned, forking after numba's tbb threads have started can hang the parent at exit
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        #consecutive blocks are sent together (~1e5 systems per round trip) and only 2*n_jobs batches are in
+        #flight, so memory does not grow with nsample when the blocks are consumed slower than they are made
+        nbatch= max(1, min(int(1e5)//block_size, -(-nblocks//n_jobs)))
+        batches= iter(lambda: list(itertools.islice(tasks, nbatch)), [])
+        with ProcessPoolExecutor(max_workers=min(n_jobs, nblocks), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(self,)) as executor:
+            futures= collections.deque(executor.submit(_simulate_worker_blocks, batch)
+                                       for batch in itertools.islice(batches, 2*n_jobs))
+            idx= 0
+            while futures:
+                tables= futures.popleft().result()
+                futures.extend(executor.submit(_simulate_worker_blocks, batch) for batch in itertools.islice(batches, 1))
+                for table in tables:
+                    yield table, idx==nblocks-1
+                    idx += 1
+
+    def _simulate_block(self, rng, nsample, additional_columns, mode, steps):
+        block= self._block(nsample, rng)
+        block._simulate_stream(additional_columns=additional_columns, mode=mode)
+        for name, kwargs in steps:
+            getattr(block, name)(**kwargs)
+        return block.table
+
+    def _block(self, nsample, rng):
+        #same configuration, own columns and random stream
+        block= copy.copy(self)
+        block.nsample= nsample
+        block.seed= block.rng= rng
+        block._steps= []
+        block.table= PopulationTable(float_dtype=self.table.float_dtype, double_columns=self.table.double_columns)
+        return block
+
+    @_pipeline_step
     def add_kinematics(self, ra, dec, kind='thin_disk', red_prop_motions_keys=[]):
         #transform whatever footprint to have the same shape as the distance array
-        idxs=np.random.choice(range(len(ra)), len(self.distance), replace=True) #temporary solution
-        vs=get_velocities(np.array(ra)[idxs], np.array(dec)[idxs], np.array(self.distance), population=kind, age=np.array(self.age))
+        idxs=self.rng.choice(len(ra), len(self.distance), replace=True) #temporary solution
+        vs=get_velocities(np.array(ra)[idxs], np.array(dec)[idxs], np.array(self.distance), population=kind, age=np.array(self.age), rng=self.rng)
 
         for k in red_prop_motions_keys:
             #compute red 
@@ -313,22 +579,118 @@ class Population(object):
             mag=np.array( getattr(self, k))
             vs['redH_'+k]= mag+5*np.log10(mu)-10 #
 
-        #add these values as attributes of the object
-        vals=vs.to_dict(orient='list')
-        for k, v in vals.items():
-            setattr(self, k, v)
+        #add these values to the table
+        for k in vs.columns:
+            self.table[k]= vs[k].to_numpy()
 
 
-    def apply_selection():
-        #should delete previous entries to save space
-        #selection should be a complex string --> sql to pass into series
-        # must think about color-cuts
-        #there must be a way to resample to nsample after making selection to not risk losing too many stars
-        raise NotImplementedError
+    def apply_selection(self, selection, nselected=None, block_size=1e5, max_blocks=1000):
+        """
+        Keep the systems that pass a selection, the rejected rows are removed from every column
+
+        Args:
+        ----
+            selection: expression evaluated over the columns with pandas.eval (str, e.g. 'VISTA_J < 17 and spt > 30',
+                       names with dashes go in backticks), a callable taking the population and returning a boolean
+                       array, or a list of those that must all pass
+            nselected: optional, number of systems to keep. If fewer pass, extra blocks are simulated, replaying
+                       simulate, the add_* steps and the previous selections, until nselected is reached (int)
+            block_size: optional, maximum number of systems simulated per extra block (int)
+            max_blocks: optional, maximum number of extra blocks (int)
+        Returns:
+        -------
+            None, nsimulated is the number of systems simulated to obtain the selected ones. When the selected
+            systems are cut down to nselected it is scaled by the same fraction (float), so that
+            len(self.table)/nsimulated stays the acceptance rate
+
+        Example:
+        -------
+            > p.simulate()
+            > p.add_distances(Disk(), l, b, 0.1, 1000)
+            > p.add_magnitudes(['VISTA_J'])
+            > p.apply_selection(['VISTA_J < 17', lambda p: p.spt > 30], nselected=1000)
+        """
+        self.table.compress(self._selection_mask(selection))
+        self._steps.append(('apply_selection', {'selection': selection}))
+        if nselected is None or len(self.table) >= nselected:
+            if nselected is not None:
+                self._keep_first(nselected)
+            return
+        if self._simulate_kwargs is None:
+            raise ValueError('nselected requires a population made with simulate')
+
+        tables= [self.table]
+        nkept= len(self.table)
+        for _ in range(int(max_blocks)):
+            #size the next block from the acceptance rate so far, at most block_size to bound memory
+            nblock= int(block_size) if nkept==0 else min(int(block_size), int(1.2*(nselected-nkept)*self.nsimulated/nkept)+1)
+            tables.append(self._simulate_block(spawn_rngs(self.rng, 1)[0], nblock, steps=self._steps, **self._simulate_kwargs))
+            nkept += len(tables[-1])
+            self.nsimulated += nblock
+            if nkept >= nselected:
+                break
+        else:
+            warnings.warn('only {} of {} systems selected after {} extra blocks'.format(nkept, nselected, max_blocks))
+        self.table= PopulationTable.concatenate(tables, nkept)
+        self._keep_first(nselected)
+
+    def _keep_first(self, nselected):
+        #the rows are in random order, dropping a fraction of them drops the same fraction of the simulated systems
+        nkept= len(self.table)
+        if nkept > nselected:
+            self.nsimulated= self.nsimulated*nselected/nkept
+            self.table.compress(np.arange(nkept) < nselected)
+
+    def _selection_mask(self, selection):
+        if isinstance(selection, (list, tuple)):
+            masks= [self._selection_mask(s) for s in selection]
+            return np.logical_and.reduce(masks) if masks else np.ones(len(self.table), dtype=bool)
+        if callable(selection):
+            mask= selection(self)
+        else:
+            mask= self.to_dataframe().eval(selection)
+        mask= np.asarray(mask, dtype=bool)
+        if mask.shape != (len(self.table),):
+            raise ValueError('selection {} must give one boolean per system'.format(selection))
+        return mask
+
+
+#population used by the worker processes of Population.simulate(n_jobs=...)
+_WORKER_POPULATION=None
 
+def _init_worker(population):
+    global _WORKER_POPULATION
+    _WORKER_POPULATION= population
+
+def _simulate_worker_blocks(tasks):
+    return [_WORKER_POPULATION._simulate_block(*task) for task in tasks]
+
+def _binary_temperatures(spt, rng):
+    #kirkpatrick relation for late types, pecaut otherwise, one call per relation
+    spt = np.asarray(spt, dtype=float)
+    mask = spt > 20
+    temperature = np.empty_like(spt)
+    temperature[mask] = spt_to_teff_kirkpatrick(spt[mask], rng=rng)[0]
+    temperature[~mask] = spt_to_teff_pecaut(spt[~mask], rng=rng)
+    return temperature
 
 #need to rewrite to account for when magnitudes are passed as well
-def make_systems(mods, bfraction):
+def make_systems(mods, bfraction, rng=None, mode='resample'):
+    """
+    Combine evolved single stars and binary components into systems
+
+    Args:
+    ----
+        mods: dictionary with the evolved singles, primaries and secondaries and their spectral types
+        bfraction: binary fraction (float)
+        rng: optional, seed or np.random.Generator (see core_tools.get_rng)
+        mode: optional, 'resample' draws binaries with replacement to reach bfraction,
+              'exact' keeps every single and every binary once, in random order
+    Returns:
+    -------
+        systems (pandas.DataFrame)
+    """
+    rng = get_rng(rng)
     
     def create_singles(mods):
         singles = mods['sing_evol'].copy()
@@ -346,7 +708,7 @@ def make_systems(mods, bfraction):
             'pri_mass': mods['prim_evol']['mass'],
             'sec_mass': mods['sec_evol']['mass'],
             'luminosity': np.log10(10 ** mods['prim_evol']['luminosity'] + 10 ** mods['sec_evol']['luminosity']),
-            'spt': np.random.normal(mods['binary_spt'], 0.3),
+            'spt': rng.normal(mods['binary_spt'], 0.3),
             'prim_spt': mods['prim_spt'],
             'sec_spt': mods['sec_spt'],
             'prim_luminosity': 10 ** mods['prim_evol']['luminosity'],
@@ -354,82 +716,66 @@ def make_systems(mods, bfraction):
             'is_binary': np.ones_like(mods['sec_spt'], dtype=bool)
         }
 
-        mask = binaries['spt'] > 20
-        teff_func = np.vectorize(lambda spt: spt_to_teff_kirkpatrick(spt)[0] if spt > 20 else spt_to_teff_pecaut(spt))
-        binaries['temperature'] = teff_func(binaries['spt'])
+        binaries['temperature'] = _binary_temperatures(binaries['spt'], rng)
         return binaries
 
     def choose_binaries(binaries, n_draw):
-        random_int = np.random.choice(np.arange(len(binaries['spt'])), n_draw)
+        random_int = rng.choice(len(binaries['spt']), n_draw)
         return {k: binaries[k][random_int] for k in binaries.keys()}
 
     singles = create_singles(mods)
     binaries = create_binaries(mods)
 
+    if mode == 'exact':
+        res = pd.concat([pd.DataFrame(singles), pd.DataFrame(binaries)], ignore_index=True)
+        return res.iloc[rng.permutation(len(res))]
+
     n_draw = int(len(mods['sing_spt']) / (1 - bfraction)) - len(mods['sing_spt'])
     chosen_binaries = choose_binaries(binaries, n_draw)
 
     res = pd.concat([pd.DataFrame(singles), pd.DataFrame(chosen_binaries)])
     return res
 
-def pop_mags(x, d=None, keys=[], object_type='dwarfs', get_from='spt', reference=None, pol=None):
+def pop_mags(x, d=None, keys=[], object_type='dwarfs', get_from='spt', reference=None, pol=None, rng=None, \
+             scatter=0.01, dtype=np.float64, as_array=False):
     """
-    Compute magnitudes from pre-computed absolute mag relations
-
-        Class for a poulation
-
-        Attributes:
-        ----
-            x_grid: grid of values ( array)
-            cdf:  corresponding values from the CDF
-            nsample: optional, number of samples
-
-        Properties:
-        -------
-            random draws
+    Compute magnitudes from pre-computed absolute mag relations, all filters in a single pass
 
-        Methods:
-        --------
-
-        Example:
-        -------
-            > x = np.arange(0, 10)
-            > cdf = x**3/(x[-1]**3)
-            > res= random_draw(x, cdf)
+    Args:
+    ----
+        x: spectral types or temperatures (array)
+        d: optional, distances in pc, apparent magnitudes are added when given (array)
+        keys: filters (list)
+        object_type: optional, 'dwarfs' or 'subdwarfs'
+        get_from: optional, 'spt' or 'teff'
+        reference, pol: optional, custom relations
+        rng: optional, seed or np.random.Generator (see core_tools.get_rng)
+        scatter: optional, None, 'relation' (scatter of each relation) or a float in mag
+        dtype: optional, np.float64 or np.float32
+        as_array: optional, return the (N, nfilters) array of absolute magnitudes instead of a DataFrame
+    Returns:
+    -------
+        DataFrame with abs_<filter> (and <filter> if d is given) columns, nans outside the relations
 
+    Example:
+    -------
+        > mags= pop_mags(spt, d=distance, keys=['2MASS_J', '2MASS_H'], rng=0)
     """
     from .abs_mag_relations import POLYNOMIALS
-    res={}
     if pol is None: pol=POLYNOMIALS['absmags_{}'.format(get_from)][object_type]
     if reference is not None: pol=POLYNOMIALS['references'][reference]
-    for k in keys:
-        #print (keys)
-        #sometimes sds don't have absolute magnitudes defined 
-        if k not in pol.keys():
-            warnings.warn("{} relation not available for {} ".format(k,object_type))
-
-        fit=np.poly1d(pol[k]['fit'])
-        #scat=pol[k]['scatter'] #ignore scatter for now
-        scat=0.01
-
-        #print (k, 'scatter', scat)
-        rng=pol[k]['range']
-        mag_key=pol[k]['y']
-        offset=pol[k]['x0']
-        #put constraints on spt range
-        mask= np.logical_and(x >rng[0], x <=rng[-1])
-        absmag= np.random.normal(fit(x-offset),scat)
-        #forget about scatter for now
-        #absmag= fit(x-offset)
-
-        masked_abs_mag= np.ma.masked_array(data=absmag, mask=~mask)
-        #make it nans outside the range
-        if d is not None: 
-            res.update({ k: masked_abs_mag.filled(np.nan)+5*np.log10(d/10.0) })
-        res.update({'abs_'+ k: masked_abs_mag.filled(np.nan)})
-
-
-    return pd.DataFrame(res)
+    compiled= compile_poly1d_relations(pol, keys)
+    absmags= evaluate_poly1d_relations(compiled, x, scatter=scatter, rng=rng, dtype=dtype)
+    if as_array:
+        return absmags
+
+    res={}
+    distance_modulus= None if d is None else (5*np.log10(np.asarray(d, dtype=float).ravel()/10.0)).astype(dtype)
+    for idx, k in enumerate(keys):
+        if d is not None:
+            res[k]= absmags[:, idx]+distance_modulus
+        res['abs_'+k]= absmags[:, idx]
+    return pd.DataFrame(res, copy=False)
 
 
 def compute_vols_and_numbers(df, gmodel, sptgrid, footprint, maglimits):
@@ -8,4 +8,14 @@ def test_binaries():
     #must be a pickle file with columns prim, sec, sys all floats
     tbl=pd.DataFrame(BINARIES)
 
-    assert len(tbl) >0
\ No newline at end of file
+    assert len(tbl) >0
+def test_get_system_type():
+    import numpy as np
+    from popsims.binaries import BINARIES
+    from popsims.core import get_system_type
+    tbl=pd.DataFrame(BINARIES).query('prim <= 39')
+    assert np.allclose(get_system_type(tbl.prim.values, tbl.sec.values), tbl.sys.values)
+    sc=np.array([np.nan, 30., 20.])
+    res=get_system_type(np.array([20., 12., 25.]), sc)
+    assert np.isnan(sc[0])
+    assert res[0]==20. and res[1]==12. and np.isnan(res[2])
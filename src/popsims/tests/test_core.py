@@ -12,4 +12,131 @@ def test_evolutionary_model_interpolator():
 	vals=evolutionary_model_interpolator( mass, age, 'saumon2008',  subset=('cloud', 'hybrid'))
 	teffs=vals['temperature'].value
 	teffs=teffs[~np.isnan(teffs)]
-	assert (( teffs< 5000).all())
\ No newline at end of file
+	assert (( teffs< 5000).all())
+def test_evolutionary_model_triangulation_cache():
+	from popsims.core import EvolutionaryModel
+	from popsims.evol_models import EVOL_MODELS
+	from scipy.interpolate import griddata
+	model= EvolutionaryModel(pd.DataFrame(EVOL_MODELS['baraffe2003']))
+	lmass= np.log10(np.random.uniform(0.02, 0.1, 100))
+	lage= np.log10(np.random.uniform(0.1, 10, 100))
+	res= model.interpolate('mass', 'age', lmass, lage, interp_columns=['temperature', 'luminosity'])
+	tri= model.triangulation('mass', 'age')
+	model.interpolate('mass', 'age', lmass, lage, interp_columns=['temperature'])
+	assert model.triangulation('mass', 'age') is tri
+	assert len(model.prepared_grid().triangulations)==1
+	data= EVOL_MODELS['baraffe2003']
+	points= np.array([np.log10(data['mass']), np.log10(data['age'])]).T
+	expected= griddata(points, np.log10(data['temperature']), (lmass, lage), method='linear')
+	assert np.allclose(res.temperature.values, expected, equal_nan=True)
+
+def test_evolutionary_model_barycentric_interpolation():
+	from popsims.core import EvolutionaryModel
+	from popsims.evol_models import EVOL_MODELS
+	model= EvolutionaryModel(pd.DataFrame(EVOL_MODELS['phillips2020']))
+	lmass= np.log10(np.random.uniform(0.01, 0.1, 100))
+	lage= np.log10(np.random.uniform(0.01, 10, 100))
+	columns= ['temperature', 'luminosity', 'radius', 'mko_j', 'w1']
+	bary= model.interpolate('mass', 'age', lmass, lage, interp_columns=columns, method='barycentric')
+	linear= model.interpolate('mass', 'age', lmass, lage, interp_columns=columns, method='linear')
+	for c in columns:
+		assert np.allclose(bary[c].values, linear[c].values, equal_nan=True)
+
+def test_evolutionary_model_grids():
+	from popsims.evol_models import EVOL_MODELS, EvolutionaryModelGrids
+	grids= EvolutionaryModelGrids()
+	assert 'saumon2008' in grids
+	assert len(grids._models)==0
+	saumon= grids['saumon2008']
+	assert isinstance(saumon['temperature'], np.memmap)
+	assert set(np.unique(saumon['cloud']))=={'f2', 'hybrid', 'nc'}
+	assert list(grids._models.keys())==['saumon2008']
+	assert len(pd.DataFrame(EVOL_MODELS['baraffe2003']))==235
+
+def test_lazy_import():
+	import subprocess, sys
+	code= "import sys, popsims; print(any(m in sys.modules for m in ['numba', 'astropy', 'seaborn', 'popsims.evol_models']))"
+	out= subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+	assert out.stdout.strip()=='False'
+	import popsims
+	assert popsims.Disk is popsims.galaxy.Disk
+
+def test_lazy_import_unknown_names():
+	import subprocess, sys, importlib
+	import popsims
+	#the star-imported modules are exported through their __all__
+	for module_name in ['core', 'core_tools', 'simulator']:
+		module= importlib.import_module('popsims.'+module_name)
+		for name in module.__all__:
+			assert popsims._LAZY_ATTRIBUTES[name]==module_name
+			assert getattr(popsims, name) is getattr(module, name)
+	#attribute probes of names that are not exported import nothing
+	code= ("import sys, popsims; print([hasattr(popsims, n) for n in ['_ipython_display_', '_repr_html_', 'np', 'nope']], "
+		"any(m in sys.modules for m in ['numba', 'scipy', 'pandas', 'popsims.core']))")
+	out= subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+	assert out.stdout.strip()=='[False, False, False, False] False'
+
+def test_evolutionary_model_regular_grid():
+	from popsims.core import EvolutionaryModel
+	from popsims.evol_models import EVOL_MODELS
+	model= EvolutionaryModel(pd.DataFrame(EVOL_MODELS['baraffe2003']))
+	lmass= np.log10(np.random.uniform(0.02, 0.1, 1000))
+	lage= np.log10(np.random.uniform(0.1, 10, 1000))
+	grid= model.regular_grid('mass', 'age', resolution=(128, 128))
+	assert grid['table'].shape==(128, 128, len(grid['columns']))
+	assert model.regular_grid('mass', 'age', resolution=(128, 128)) is grid
+	fast= model.interpolate('mass', 'age', lmass, lage, interp_columns=['temperature'], method='grid', resolution=(128, 128))
+	exact= model.interpolate('mass', 'age', lmass, lage, interp_columns=['temperature'])
+	assert np.nanmedian(np.abs(fast.temperature.values-exact.temperature.values)) < grid['max_deviation']['temperature']
+
+def test_evolutionary_model_metallicity_and_subsets():
+	from popsims.core import EvolutionaryModel
+	from popsims.evol_models import EVOL_MODELS
+	model= EvolutionaryModel(pd.DataFrame(EVOL_MODELS['saumon2008']))
+	lmass= np.log10(np.random.uniform(0.02, 0.07, 100))
+	lage= np.log10(np.random.uniform(0.5, 5, 100))
+	met= np.random.uniform(-0.3, 0.3, 100)
+	res= model.interpolate('mass', 'age', lmass, lage, z_axis='metallicity', z_values=met, subset=('cloud', 'nc'))
+	assert np.isfinite(res.temperature.values).mean() > 0.9
+	clouds= np.random.choice(['nc', 'hybrid', 'f2'], 100)
+	mixed= model.interpolate('mass', 'age', lmass, lage, subset=('cloud', clouds))
+	hybrid= model.interpolate('mass', 'age', lmass, lage, subset=('cloud', 'hybrid'))
+	sel= clouds=='hybrid'
+	assert np.allclose(mixed.temperature.values[sel], hybrid.temperature.values[sel], equal_nan=True)
+	assert set(model._subsets.keys())=={('cloud', 'nc'), ('cloud', 'hybrid'), ('cloud', 'f2')}
+
+def test_model_cache():
+	from popsims.core import EvolutionaryModel, ModelCache
+	cache= ModelCache(maxsize=2)
+	for name in ['baraffe2003', 'marley2019', 'baraffe2003', 'baraffe2015']:
+		model= EvolutionaryModel.from_name(name)
+		model.cache= cache
+		model.interpolate('mass', 'age', np.log10([0.05]), np.log10([1.]))
+	stats= cache.stats()
+	assert stats['size']==2 and stats['misses']==3 and stats['hits'] > 0
+	assert stats['nbytes'] > 0
+	assert list(cache.keys())[0][0]=='baraffe2003'
+	grid= model.prepared_grid()
+	assert grid.values.dtype==np.float64 and grid.values.flags['C_CONTIGUOUS']
+
+def test_evolutionary_model_as_dict():
+	from popsims.core import EvolutionaryModel
+	model= EvolutionaryModel.from_name('baraffe2003')
+	lmass= np.log10(np.random.uniform(0.02, 0.1, 100))
+	lage= np.log10(np.random.uniform(0.1, 10, 100))
+	df= model.interpolate('mass', 'age', lmass, lage, interp_columns=['temperature', 'luminosity'])
+	res= model.interpolate('mass', 'age', lmass, lage, interp_columns=['temperature', 'luminosity'], as_dict=True)
+	for col in ['mass', 'age', 'temperature', 'luminosity']:
+		assert np.allclose(res[col], df[col].values, equal_nan=True)
+
+def test_named_model_memory_mapped():
+	import pickle
+	from popsims.core import EvolutionaryModel
+	model= EvolutionaryModel.from_name('saumon2008')
+	assert isinstance(model._grid['temperature'], np.memmap) and isinstance(model._grid['cloud'], np.memmap)
+	grid= model.prepared_grid()
+	assert 'cloud' not in grid.columns and grid.values.dtype==np.float64
+	assert np.allclose(grid.values[:, grid.index['temperature']], np.log10(model._grid['temperature']))
+	#named models are pickled by name, not with their grid
+	assert len(pickle.dumps(model)) < 1000
+	assert pickle.loads(pickle.dumps(model)).name=='saumon2008'
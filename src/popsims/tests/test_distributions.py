@@ -0,0 +1,34 @@
+################################
+# test distributions.py functions 
+##############################
+from popsims.distributions import *
+from popsims.simulator import Population
+import numpy as np
+
+def test_lognormal_imf():
+	imf= LogNormalIMF(mmin=0.01, mmax=1)
+	m= imf.sample(int(1e5))
+	assert len(m)==int(1e5)
+	assert m.min() >= 0.01 and m.max() <= 1
+	#the table is built once
+	assert imf.table is imf.table
+	#log-normal in log m, peaked at mc
+	hist, edges= np.histogram(np.log10(m), bins=20)
+	assert np.abs(edges[np.argmax(hist)]-np.log10(0.079)) < 0.3
+
+def test_exponential_sfh():
+	sfh= ExponentialSFH(tau=2., tmin=0.01, tmax=14)
+	ages= sfh.sample(int(1e5))
+	assert ages.min() >= 0.01 and ages.max() <= 14
+	assert np.isclose(np.median(ages), np.interp(0.5, sfh.table[1], sfh.table[0]), atol=0.05)
+
+def test_tabulated_distribution():
+	dist= TabulatedDistribution([0, 1, 2], [0, 1, 0])
+	x= dist.sample(int(1e4))
+	assert np.isclose(np.mean(x), 1, atol=0.05)
+
+def test_population_with_distributions():
+	p= Population(evolmodel='baraffe2003', imf=BrokenPowerLawIMF.kroupa(mmin=0.05, mmax=0.1),
+	              sfh=UniformAges(1, 2), nsample=100)
+	assert (p._sample_masses() >= 0.05).all()
+	assert (p._sample_ages() >= 1).all()
@@ -18,4 +18,236 @@ def test_population():
     df=p.to_dataframe(['mass', 'age', 'temperature'])
     assert len(p.mass) ==1000
     assert len(df)==1000
-    print (df)
\ No newline at end of file
+    print (df)
+
+def test_population_seed():
+    dfs=[]
+    for _ in range(2):
+        p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2,
+                      nsample=500, seed=12)
+        p.simulate()
+        dfs.append(p.to_dataframe(['mass', 'age', 'temperature', 'spt']))
+    pd.testing.assert_frame_equal(dfs[0], dfs[1])
+
+def test_population_modes():
+    import numpy as np
+    for mode in ['exact', 'resample']:
+        p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.3,
+                      nsample=2000, seed=3)
+        p.simulate(mode=mode)
+        assert len(p.mass)==2000
+        assert abs(np.mean(p.is_binary)-0.3) < 0.05
+
+def test_pop_mags():
+    import numpy as np
+    from popsims.abs_mag_relations import POLYNOMIALS
+    pol=POLYNOMIALS['absmags_spt']['dwarfs']
+    keys=['VISTA_J', 'UKIDSS_H', 'LSST_G']
+    spt=np.array([5., 20., 25., 30., 45.])
+    mags=pop_mags(spt, d=np.full(5, 100.), keys=keys, scatter=None)
+    for k in keys:
+        lo, hi=pol[k]['range'][0], pol[k]['range'][-1]
+        inside=np.logical_and(spt > lo, spt <= hi)
+        expected=np.where(inside, np.poly1d(pol[k]['fit'])(spt-pol[k]['x0']), np.nan)
+        assert np.allclose(mags['abs_'+k].values, expected, equal_nan=True)
+        assert np.allclose(mags[k].values, expected+5., equal_nan=True)
+    arr=pop_mags(spt, keys=keys, scatter='relation', rng=0, dtype=np.float32, as_array=True)
+    assert arr.shape==(5, 3) and arr.dtype==np.float32
+
+def test_population_colors():
+    import numpy as np
+    from popsims.abs_mag_relations import POLYNOMIALS
+    p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=500, seed=4)
+    p.simulate()
+    p.add_colors([('LSST_Y', 'PANSTARRS_Y'), 'PANSTARRS_RandLSST_R'])
+    fit=POLYNOMIALS['colors_spt']['dwarfs']['LSST_YandPANSTARRS_Y']
+    spt=np.array(p.spt)
+    inside=np.logical_and(spt > fit['range'][0], spt <= fit['range'][-1])
+    assert inside.sum() > 10
+    assert np.allclose(getattr(p, 'LSST_Y-PANSTARRS_Y')[inside], np.poly1d(fit['fit'])(spt[inside]-fit['x0']))
+    assert np.isnan(getattr(p, 'LSST_Y-PANSTARRS_Y')[~inside]).all()
+    fit=POLYNOMIALS['colors_spt']['dwarfs']['LSST_RandPANSTARRS_R']
+    inside=np.logical_and(spt > fit['range'][0], spt <= fit['range'][-1])
+    assert np.allclose(getattr(p, 'PANSTARRS_R-LSST_R')[inside], -np.poly1d(fit['fit'])(spt[inside]-fit['x0']))
+    assert len(p.to_dataframe(['spt', 'LSST_Y-PANSTARRS_Y']))==500
+
+def test_population_table():
+    import numpy as np
+    p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=500, seed=5)
+    p.simulate()
+    assert p.table['mass'].dtype==np.float32 and p.is_binary.dtype==bool
+    assert 'mass' in dir(p) and p.mass is p.table['mass']
+    df=p.to_dataframe(['mass', 'is_binary'])
+    assert np.shares_memory(df['mass'].to_numpy(), p.mass)
+    try:
+        p.not_a_column
+        assert False
+    except AttributeError:
+        pass
+    #columns attached as attributes go into the table
+    p.double_mass= p.mass*2
+    assert 'double_mass' in p.table and 'double_mass' not in p.__dict__
+    assert np.allclose(p.to_dataframe()['double_mass'], 2*p.mass)
+    p.apply_selection('double_mass > 0.1')
+    assert len(p.double_mass)==len(p.mass) and (p.double_mass > 0.1).all()
+    del p.double_mass
+    assert 'double_mass' not in p.table
+    p.note= np.arange(3)
+    assert 'note' in p.__dict__
+
+def test_population_table_double_columns():
+    import numpy as np
+    from popsims.galaxy import Disk
+    p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=500, seed=5)
+    p.simulate()
+    p.add_distances(Disk(), l=[0.1], b=[0.5], dmin=1e4, dmax=2e4, dsteps=100)
+    p.add_magnitudes(['VISTA_J'])
+    assert p.distance.dtype==np.float64 and p.mass.dtype==np.float32
+    finite=np.isfinite(p.VISTA_J)
+    assert finite.sum() > 10
+    assert np.allclose((p.VISTA_J-p.abs_VISTA_J)[finite], 5*np.log10(p.distance[finite]/10.), atol=1e-5)
+
+def test_iter_simulate():
+    from popsims.galaxy import Disk
+    steps=[('add_distances', dict(gmodel=Disk(), l=[0.1, 1.], b=[0.5, 0.2], dmin=1, dmax=500, dsteps=100)),
+           ('add_magnitudes', dict(filters=['VISTA_J']))]
+    dfs=[]
+    for chunk_size in [700, 2000]:
+        p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=3000, seed=7)
+        chunks=list(p.iter_simulate(chunk_size=chunk_size, steps=steps, block_size=1000))
+        assert max(len(c) for c in chunks) <= chunk_size
+        dfs.append(pd.concat(chunks))
+    assert len(dfs[0])==3000 and 'VISTA_J' in dfs[0].columns
+    pd.testing.assert_frame_equal(dfs[0], dfs[1])
+
+def test_iter_simulate_lazy(monkeypatch):
+    #the blocks of a large population are only set up when they are simulated
+    import popsims.simulator as simulator
+    calls=[]
+    spawn_rngs=simulator.spawn_rngs
+    monkeypatch.setattr(simulator, 'spawn_rngs', lambda *args, **kwargs: calls.append(args) or spawn_rngs(*args, **kwargs))
+    p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=1e9, seed=7)
+    chunks=p.iter_simulate(chunk_size=1000, block_size=1000)
+    assert len(next(chunks))==1000 and len(calls)==1
+    assert len(next(chunks))==1000 and len(calls)==2
+
+def test_population_n_jobs(monkeypatch):
+    import os
+    #pretend there are two cores so that the process pool is used on any machine
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {0, 1}, raising=False)
+    tables=[]
+    for kwargs in [{}, {'n_jobs': 1}, {'n_jobs': 2}]:
+        p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=3000, seed=11)
+        p.simulate(block_size=1000, **kwargs)
+        assert len(p.mass)==3000
+        tables.append(p.to_dataframe())
+    pd.testing.assert_frame_equal(tables[0], tables[1])
+    pd.testing.assert_frame_equal(tables[0], tables[2])
+    chunks=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=3000, seed=11).iter_simulate(chunk_size=3000, block_size=1000)
+    pd.testing.assert_frame_equal(next(chunks), tables[0])
+
+def test_population_n_jobs_window(monkeypatch):
+    import os
+    import concurrent.futures
+    #in-process executor that records how many batches are in flight
+    submitted=[]
+    class Executor(object):
+        def __init__(self, max_workers, mp_context, initializer, initargs):
+            initializer(*initargs)
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            return False
+        def submit(self, fn, arg):
+            submitted.append(len(arg))
+            future=concurrent.futures.Future()
+            future.set_result(fn(arg))
+            return future
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {0, 1}, raising=False)
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', Executor)
+    p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=1e7, seed=11)
+    blocks=p._iter_blocks(1e4, n_jobs=2)
+    table, last=next(blocks)
+    assert len(table)==1e4 and not last
+    #2*n_jobs batches of 10 blocks, plus the one submitted when the first batch is collected
+    assert submitted==[10]*5
+
+def test_apply_selection():
+    import numpy as np
+    p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=2000, seed=8)
+    p.simulate()
+    p.add_magnitudes(['VISTA_J'])
+    nkept=np.sum((p.abs_VISTA_J < 12) & (p.temperature < 2500))
+    p.apply_selection(['abs_VISTA_J < 12', lambda p: p.temperature < 2500])
+    assert len(p.mass)==nkept and len(p.abs_VISTA_J)==nkept
+    p.apply_selection('is_binary or not is_binary', nselected=3*nkept, block_size=1000)
+    assert len(p.mass)==3*nkept and p.nsimulated > 2000
+    assert (p.abs_VISTA_J < 12).all() and (p.temperature < 2500).all()
+
+def test_magnitude_limited_distances():
+    import numpy as np
+    from popsims.galaxy import Disk
+    gmodel, l, b=Disk(), [0.3, 2.], [0.8, -0.4]
+    counts=[]
+    for maglimits in [None, {'VISTA_J': (8, 21.)}]:
+        p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=20000, seed=21)
+        p.simulate()
+        p.add_magnitudes(['VISTA_J'])
+        p.add_distances(gmodel, l, b, 1, 2000, dsteps=200, maglimits=maglimits)
+        if maglimits is None:
+            J=p.abs_VISTA_J+5*np.log10(p.distance/10.)
+            counts.append(np.sum((J > 8) & (J < 21)))
+        else:
+            observed=p.weight > 0
+            assert (p.VISTA_J[observed] < 21).all() and np.isnan(p.distance[~observed]).all()
+            counts.append(p.weight.sum())
+    assert abs(counts[1]/counts[0]-1) < 0.15
+
+def test_kroupa_masses():
+    import numpy as np
+    from scipy.integrate import quad
+    from popsims.distributions import BrokenPowerLawIMF
+    #regression: 'kroupa' is a continuous broken power law, ~30% of the masses are below 0.08 Msun over 0.01-1 Msun
+    #(the equal-weight mix of segments used before gave ~38%)
+    imf=BrokenPowerLawIMF.kroupa(0.01, 1.)
+    expected=quad(imf.pdf, 0.03, 0.08)[0]/sum(quad(imf.pdf, lo, hi)[0] for lo, hi in [(0.03, 0.08), (0.08, 0.5), (0.5, 1.)])
+    p=Population(imf_power='kroupa', mass_range=[0.01, 1.], nsample=100000, seed=2)
+    masses=p._sample_masses()
+    assert abs(expected-0.298) < 0.002
+    assert abs(np.mean(masses < 0.08)-expected) < 0.005
+    assert masses.min() >= 0.03 and masses.max() <= 1.
+
+def test_binary_temperatures():
+    import numpy as np
+    from popsims.simulator import _binary_temperatures
+    from popsims.relations import spt_to_teff_kirkpatrick, spt_to_teff_pecaut
+    rng=np.random.default_rng(5)
+    per_element=np.vectorize(lambda spt: spt_to_teff_kirkpatrick(spt, rng=rng)[0] if spt > 20 else spt_to_teff_pecaut(spt, rng=rng))
+    #all-early, all-late and mixed inputs, the batched draws have the per-element mean and scatter
+    for spts in [[12., 18.], [22., 30., 38.], [15., 25.]]:
+        spt=np.repeat(spts, 3000)
+        batched=_binary_temperatures(spt, rng)
+        reference=per_element(spt)
+        for value in spts:
+            a, b=batched[spt==value], reference[spt==value]
+            assert abs(a.mean()-b.mean()) < 4*b.std()/np.sqrt(len(b))*np.sqrt(2)
+            assert abs(a.std()/b.std()-1) < 0.1
+    assert _binary_temperatures(np.array([]), rng).shape==(0,)
+
+def test_population_column_names():
+    p=Population(evolmodel= 'baraffe2003', nsample=100, seed=1)
+    p.simulate(additional_columns=['radius'])
+    assert 'radius' in p.table and all(type(k) is str for k in p.table.keys())
+
+def test_apply_selection_nsimulated():
+    import numpy as np
+    #a selection that keeps everything, cut down to nselected, keeps the acceptance rate at one
+    p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=2000, seed=9)
+    p.simulate()
+    p.apply_selection(lambda p: np.ones(len(p.mass), dtype=bool), nselected=500)
+    assert len(p.mass)==500 and p.nsimulated==500
+    #same with top-up blocks that overshoot
+    p=Population(evolmodel= 'baraffe2003', imf_power= -0.6, binary_fraction=0.2, nsample=1000, seed=9)
+    p.simulate()
+    p.apply_selection('age > 0', nselected=2500, block_size=1000)
+    assert len(p.mass)==2500 and np.isclose(p.nsimulated, 2500)
@@ -37,11 +37,97 @@ def test_group_by():
 def test_k_clip_fit():
 	pass
 
-@pytest.mark.skip(reason="example not implemented in docstring")
-def apply_polynomial_relation():
-	pass
+def test_apply_polynomial_relation():
+	from popsims.relations import LITERATURE_POLYNOMIALS
+	pol= LITERATURE_POLYNOMIALS['kirkpatrick2021']['x=spt,y=teff']
+	x= np.array([15., 25., 30., 45.])
+	mean, std= apply_polynomial_relation(pol, x, nsample=5000, rng=1)
+	exact, scatter= polynomial_mean_and_scatter(pol, x)
+	assert np.isnan(mean[[0, -1]]).all()
+	assert np.allclose(mean[1:-1], exact[1:-1], rtol=0.01)
+	assert np.allclose(std[1:-1], scatter[1:-1], rtol=0.1)
+	#chunking does not change the draws
+	x= np.linspace(20, 40, 101)
+	assert np.array_equal(apply_polynomial_relation(pol, x, rng=2)[0], apply_polynomial_relation(pol, x, rng=2, chunksize=7)[0])
+	#empty inputs give empty outputs
+	mean, std= apply_polynomial_relation(pol, np.array([]), rng=3)
+	assert mean.shape==std.shape==(0,)
 
-@pytest.mark.skip(reason="example not implemented in docstring")
 def test_inverse_polynomial_relation():
-	pass
-    
\ No newline at end of file
+	from popsims.relations import LITERATURE_POLYNOMIALS
+	pol= LITERATURE_POLYNOMIALS['kirkpatrick2021']['x=spt,y=teff']
+	sptgrid= np.linspace(10, 43, 1000)
+	ytab, xtab, yunc= inverse_polynomial_table(pol, sptgrid)
+	assert np.all(np.diff(ytab) > 0)
+	assert inverse_polynomial_table(pol, sptgrid)[0] is ytab
+	#no scatter recovers the polynomial
+	mean, _= polynomial_mean_and_scatter(pol, np.array([25.]))
+	assert np.isclose(np.interp(mean, ytab, xtab), 25., atol=0.05)
+	spt= inverse_polynomial_relation(pol, np.full(10000, mean[0]), sptgrid, interpolation='table', rng=0)
+	assert np.isclose(np.nanmedian(spt), 25., atol=0.2)
+	assert np.isnan(inverse_polynomial_relation(pol, np.array([1e5]), sptgrid, interpolation='table', rng=0)).all()
+    
+def test_sample_from_broken_powerlaw():
+	x = sample_from_broken_powerlaw([-0.3, -1.3, -2.3], [0.03, 0.08, 0.5, 100], xmin=0.01, xmax=1, nsample=int(1e5))
+	assert len(x)==int(1e5)
+	assert x.min() >= 0.03 and x.max() <= 1
+	#fraction in the first segment matches the analytic integral of the continuous law
+	i0= (0.08**0.7-0.03**0.7)/0.7
+	i1= 0.08*(0.5**-0.3-0.08**-0.3)/-0.3
+	i2= 0.08*0.5*(1**-1.3-0.5**-1.3)/-1.3
+	assert np.isclose(np.mean(x < 0.08), i0/(i0+i1+i2), atol=0.01)
+	y = sample_from_powerlaw(-1, xmin=0.1, xmax=10, nsample=int(1e5))
+	assert np.isclose(np.mean(y < 1), 0.5, atol=0.01)
+
+def test_rng_streams():
+	a= sample_from_powerlaw(-0.6, nsample=100, rng=get_rng(3))
+	b= sample_from_powerlaw(-0.6, nsample=100, rng=3)
+	assert np.array_equal(a, b)
+	r1, r2= spawn_rngs(3, 2)
+	assert not np.array_equal(r1.random(10), r2.random(10))
+	assert np.array_equal(spawn_rngs(3, 2)[1].random(10), spawn_rngs(3, 2)[1].random(10))
+
+def test_pecaut_relations():
+	from popsims.relations import PECAUT_TEFF_SPT_RELATIONS, PECAUT_SPT_TO_TEFF, PECAUT_TEFF_TO_SPT
+	rel= PECAUT_TEFF_SPT_RELATIONS['pecaut']
+	assert np.allclose(PECAUT_SPT_TO_TEFF(rel['spt']), rel['values'])
+	assert np.allclose(PECAUT_TEFF_TO_SPT(rel['values']), rel['spt'])
+	assert np.isnan(PECAUT_SPT_TO_TEFF(np.array([-1., 50.]))).all()
+
+def test_scale_to_local_lf():
+	from popsims.relations import scale_to_local_lf, local_lf_histograms, scale_histograms_to_local_lf
+	rng= np.random.default_rng(0)
+	teffs= [rng.uniform(300, 2500, n) for n in [500, 1000, 2000]]
+	hists= local_lf_histograms(teffs)
+	assert hists.shape==(3, 11)
+	assert np.array_equal(hists[1], local_lf_histograms(teffs[1]))
+	scale, unc, total= scale_histograms_to_local_lf(hists)
+	assert np.allclose(scale[1:]*hists[1:].sum(axis=1), total[1:])
+	assert np.isclose(scale_to_local_lf(teffs[0])[0], scale[0])
+	mc= scale_to_local_lf(teffs[0], nsample=20000, rng=1)
+	assert np.isclose(mc[0], scale[0], rtol=0.01) and np.isclose(mc[1], unc[0], rtol=0.05)
+
+def test_spawn_rngs_start():
+	rngs=spawn_rngs(42, 4)
+	assert spawn_rngs(42, 1, start=2)[0].random()==rngs[2].random()
+
+def test_inverse_polynomial_relation_edges():
+	from popsims.relations import teff_to_spt_subdwarf, teff_to_spt_kirkpatrick
+	#inputs near the ends of the relations stay finite, scattered values are clipped to the table
+	for func, teff in [(teff_to_spt_subdwarf, 1700.), (teff_to_spt_kirkpatrick, 1990.), (teff_to_spt_kirkpatrick, 2236.)]:
+		spt= np.asarray(func(np.full(2000, teff), rng=0))
+		assert np.isfinite(spt).all()
+	#far outside the relation gives nans
+	assert np.isnan(np.asarray(teff_to_spt_kirkpatrick(np.full(10, 5000.), rng=0))).all()
+
+def test_relation_cache():
+	import copy
+	from popsims.core_tools import _RELATION_CACHE
+	from popsims.relations import LITERATURE_POLYNOMIALS
+	pol= LITERATURE_POLYNOMIALS['kirkpatrick2021']['x=spt,y=teff']
+	#copies of a relation share the compiled entry, the cache stays bounded
+	assert compile_polynomial_relation(copy.deepcopy(pol)) is compile_polynomial_relation(pol)
+	assert content_key(pol) != content_key({**pol, 'extra': 1})
+	for idx in range(_RELATION_CACHE.maxsize+10):
+		compile_poly1d_relations({'a': {'fit': [1., float(idx)], 'x0': 0., 'range': [0, 1], 'scatter': 0.1}}, ['a'])
+	assert len(_RELATION_CACHE) <= _RELATION_CACHE.maxsize